@@ -1,54 +1,117 @@
+import asyncio
+import base64
+import json
 import os
-import httpx
+import time
 
 from dotenv import load_dotenv
 
+from transport import get_client
+
 load_dotenv()
 
 OFN_API_BASE_URL = "https://ofn.hof-homann.de/api/"
 IQT_API_EMAIL = os.environ.get("IQT_API_EMAIL")
 IQT_API_PASSWORD = os.environ.get("IQT_API_PASSWORD")
+# Refresh the JWT this many seconds before it expires
+JWT_REFRESH_MARGIN = 60
+
+
+def jwt_expiry(token: str) -> float | None:
+    """Return the `exp` claim of a JWT without verifying it, if present."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
 
 
 class IQToolAPI:
+    """IQ Tool API client that logs in lazily and keeps its JWT fresh.
+
+    The token is obtained on first use, refreshed shortly before its `exp`
+    claim and once more if a request is rejected with 401. Concurrent
+    callers wait for a single in-flight login instead of starting their own.
+    """
+
     def __init__(self):
         self.base_url = OFN_API_BASE_URL
         self.email = IQT_API_EMAIL
         self.password = IQT_API_PASSWORD
-        self.jwt_token = self.auth(self.email, self.password)
-        self.headers = {
-            "Authorization": f"JWT {self.jwt_token}",
-            "Content-Type": "application/json",
-        }
+        self.jwt_token = None
+        self.expires_at = 0.0
+        self._lock = asyncio.Lock()
 
-    def auth(self, email, password):
+    async def auth(self, email, password):
         """Authenticate with IQ Tool API and get JWT token."""
         url = self.base_url + "token-obtain/"
         payload = {"email": email, "password": password}
-        response = httpx.post(
+        response = await get_client().post(
             url, json=payload, headers={"Content-Type": "application/json"}
         )
         response.raise_for_status()
         # Adjust the key if your API returns 'access' instead of 'token'
         return response.json().get("token") or response.json().get("access")
 
-    def post(self, endpoint, payload):
-        url = self.base_url + endpoint.lstrip("/")
-        response = httpx.post(url, json=payload, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+    def _token_valid(self) -> bool:
+        return (
+            self.jwt_token is not None
+            and time.time() < self.expires_at - JWT_REFRESH_MARGIN
+        )
+
+    async def token(self, rejected: str | None = None) -> str:
+        """Return a usable JWT, logging in if it is missing, expiring or `rejected`."""
+        if self._token_valid() and self.jwt_token != rejected:
+            return self.jwt_token
+        async with self._lock:
+            # Another caller may have refreshed it while we waited
+            if self._token_valid() and self.jwt_token != rejected:
+                return self.jwt_token
+            token = await self.auth(self.email, self.password)
+            self.jwt_token = token
+            self.expires_at = jwt_expiry(token) or float("inf")
+            return token
 
-    def get(self, endpoint, params=None):
+    async def _request(self, method: str, endpoint: str, **kwargs):
         url = self.base_url + endpoint.lstrip("/")
-        response = httpx.get(url, params=params, headers=self.headers)
+        token = await self.token()
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"JWT {token}",
+                "Content-Type": "application/json",
+            }
+            response = await get_client().request(
+                method, url, headers=headers, **kwargs
+            )
+            if response.status_code != 401 or attempt:
+                break
+            token = await self.token(rejected=token)
         response.raise_for_status()
         return response.json()
 
+    async def post(self, endpoint, payload):
+        return await self._request("POST", endpoint, json=payload)
+
+    async def get(self, endpoint, params=None):
+        return await self._request("GET", endpoint, params=params)
+
+
+_api_service = None
+
+
+def get_api_service() -> IQToolAPI:
+    """Return the process-wide IQ Tool API client."""
+    global _api_service
+    if _api_service is None:
+        _api_service = IQToolAPI()
+    return _api_service
+
 
-def get_nanostore_settings(key: str) -> str:
+async def get_nanostore_settings(key: str) -> str:
     """Get the Nanostore Settings from IQTool API."""
-    api_service = IQToolAPI()
-    response = api_service.get(f"nanostore-settings/?key={key}")
+    api_service = get_api_service()
+    response = await api_service.get(f"nanostore-settings/?key={key}")
     if response and "value" in response:
         return response["value"]
     else:
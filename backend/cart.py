@@ -1,77 +1,160 @@
-# TODO: For production, you should use a more secure way to store session data.
-# For example, use a database or a secure cache like Redis.
-# Here we use a simple in-memory dictionary for demonstration purposes.
-# This will not persist across server restarts and is not thread-safe.
-# In a production environment, consider using a more robust session management solution.
-SESSION_CARTS = {}
+from decimal import Decimal
 
 
-def get_cart_for_session(session_id: str) -> list[dict]:
-    """Retrieve cart for a specific session."""
-    return SESSION_CARTS.get(session_id, [])
+def to_decimal(value) -> Decimal:
+    """Exact Decimal for a price or quantity given as str, int or float."""
+    return value if isinstance(value, Decimal) else Decimal(str(value))
 
 
-def add_product_to_cart(session_id: str, product: dict):
-    """Add a product to the cart for the given session_id.
-    If the product already exists, increment its quantity."""
-    if session_id not in SESSION_CARTS:
-        SESSION_CARTS[session_id] = []
+class Cart:
+    """The cart of one session, with lines keyed by variant id.
 
-    cart = SESSION_CARTS[session_id]
+    Regular products have a single line per variant, weighted products get
+    a new slot for every weighing. The item count and the Decimal total are
+    updated with every change, so no operation scans the whole cart.
+    `version` increases with every change so clients can apply patches.
+    """
 
-    # For weighted products, don't combine - each weight is unique
-    if "gramm" in product:
-        # Always add as new item for weighted products
-        new_item = {
+    def __init__(self):
+        self.version = 0
+        self._reset()
+
+    def _reset(self):
+        self.lines = {}
+        self.prices = {}
+        # str(variant id) -> line keys of that variant, in insertion order
+        self.variant_lines = {}
+        self.item_count = 0
+        self.total = Decimal(0)
+        self._next_slot = 0
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def items(self) -> list[dict]:
+        return list(self.lines.values())
+
+    def _add_line(self, key: str, product: dict, line: dict):
+        self.lines[key] = line
+        self.prices[key] = to_decimal(product["price"])
+        self.variant_lines.setdefault(str(product["id"]), {})[key] = None
+        self.item_count += line["quantity"]
+        self.total += self.prices[key] * to_decimal(line["quantity"])
+
+    def _set_quantity(self, key: str, quantity):
+        line = self.lines[key]
+        delta = quantity - line["quantity"]
+        self.item_count += delta
+        self.total += self.prices[key] * to_decimal(delta)
+        line["quantity"] = quantity
+
+    def _remove_line(self, key: str):
+        line = self.lines.pop(key)
+        self.item_count -= line["quantity"]
+        self.total -= self.prices.pop(key) * to_decimal(line["quantity"])
+        variant = str(line["id"])
+        self.variant_lines[variant].pop(key)
+        if not self.variant_lines[variant]:
+            del self.variant_lines[variant]
+
+    def add(self, product: dict) -> str:
+        """Add a product and return the key of the line it went to."""
+        line = {
             "id": product["id"],
             "name": product["name"],
             "price": float(product["price"]),
-            "quantity": 1,  # Always 1 for weighted products
+            "quantity": product.get("quantity", 1),
             "img": product.get("img"),
             "category_id": product.get("category_id"),
             "category_name": product.get("category_name"),
-            "gramm": product["gramm"],
         }
-        cart.append(new_item)
-        return
-
-    # For regular products, combine quantities
-    for item in cart:
-        if item["id"] == product["id"] and "gramm" not in item:
-            item["quantity"] += product.get("quantity", 1)
-            return
-
-    # Add new regular product
-    new_item = {
-        "id": product["id"],
-        "name": product["name"],
-        "price": float(product["price"]),
-        "quantity": product.get("quantity", 1),
-        "img": product.get("img"),
-        "category_id": product.get("category_id"),
-        "category_name": product.get("category_name"),
-    }
-    cart.append(new_item)
-
-
-def update_cart_quantity(session_id: str, product_id: str, quantity: int):
-    """Update the quantity of a product in the cart."""
-    cart = SESSION_CARTS.get(session_id, [])
-    for item in cart:
-        if item["id"] == product_id:
-            item["quantity"] = quantity
-            break
-
-
-def remove_cart_item(session_id: str, product_id: str):
-    """Remove a product from the cart."""
-    cart = SESSION_CARTS.get(session_id, [])
-    SESSION_CARTS[session_id] = [
-        item for item in cart if str(item["id"]) != str(product_id)
-    ]
-
-
-def clear_cart(session_id: str):
-    """Clear the cart for a specific session."""
-    if session_id in SESSION_CARTS:
-        SESSION_CARTS[session_id] = []
+
+        self.version += 1
+        # For weighted products, don't combine - each weight is unique
+        if "gramm" in product:
+            line["quantity"] = 1  # Always 1 for weighted products
+            line["gramm"] = product["gramm"]
+            key = f"{product['id']}#{self._next_slot}"
+            self._next_slot += 1
+            self._add_line(key, product, line)
+            return key
+
+        # For regular products, combine quantities
+        key = str(product["id"])
+        if key in self.lines:
+            self._set_quantity(key, self.lines[key]["quantity"] + line["quantity"])
+        else:
+            self._add_line(key, product, line)
+        return key
+
+    def find_line(self, product_id) -> str | None:
+        """Key of the variant's regular line, else of its first weighted slot."""
+        key = str(product_id)
+        if key in self.lines:
+            return key
+        for key in self.variant_lines.get(str(product_id), ()):
+            return key
+        return None
+
+    def update_quantity(self, product_id, quantity) -> list[str]:
+        """Set the quantity of the variant's line and return its key, if any."""
+        key = self.find_line(product_id)
+        if key is None:
+            return []
+        self._set_quantity(key, quantity)
+        self.version += 1
+        return [key]
+
+    def remove(self, product_id) -> list[str]:
+        """Remove every line of the variant and return their keys."""
+        keys = list(self.variant_lines.get(str(product_id), ()))
+        for key in keys:
+            self._remove_line(key)
+        if keys:
+            self.version += 1
+        return keys
+
+    def clear(self):
+        self._reset()
+        self.version += 1
+
+    def to_dict(self) -> dict:
+        """Plain form for persisting, prices are kept as exact strings."""
+        return {
+            "version": self.version,
+            "next_slot": self._next_slot,
+            "lines": [
+                [key, line, str(self.prices[key])] for key, line in self.lines.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Cart":
+        cart = cls()
+        for key, line, price in data["lines"]:
+            cart._add_line(key, {"id": line["id"], "price": price}, line)
+        cart.version = data["version"]
+        cart._next_slot = data["next_slot"]
+        return cart
+
+    def snapshot_message(self) -> dict:
+        """Full cart message, `keys` name the lines for later patches."""
+        return {
+            "type": "cart",
+            "cart": self.items(),
+            "keys": list(self.lines),
+            "version": self.version,
+            "total": str(self.total),
+            "item_count": self.item_count,
+        }
+
+    def patch_message(self, base_version: int, keys) -> dict:
+        """Changed lines since `base_version`, a null line was removed."""
+        return {
+            "type": "cart_patch",
+            "base_version": base_version,
+            "version": self.version,
+            "lines": [{"key": key, "line": self.lines.get(key)} for key in keys],
+            "total": str(self.total),
+            "item_count": self.item_count,
+        }
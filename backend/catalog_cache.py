@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+
+# Older than any ttl, time.monotonic() may be small right after boot
+STALE = float("-inf")
+
+
+class CatalogCache:
+    """In-memory catalog cache with stale-while-revalidate refresh.
+
+    The first read loads the catalog and waits for it. After that, reads are
+    always answered from memory; once the entry is older than `ttl` seconds a
+    single background task re-runs the loader and swaps the result in, while
+    readers keep getting the stale copy. A failed refresh keeps the old data.
+    `on_change` is called on the event loop whenever new data is swapped in.
+    """
+
+    def __init__(self, loader, ttl: float, on_change=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.on_change = on_change
+        self.data = None
+        self.loaded_at = STALE
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.loaded_at > self.ttl
+
+    async def _load(self, *args):
+        data = await self.loader(*args)
+        changed = data is not self.data
+        self.data = data
+        self.loaded_at = time.monotonic()
+        if changed:
+            self._notify()
+        return data
+
+    def _notify(self):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(self.data)
+        except Exception as e:
+            print(f"Catalog change listener failed: {e}")
+
+    async def _refresh(self, *args):
+        try:
+            async with self._lock:
+                await self._load(*args)
+        except Exception as e:
+            print(f"Catalog refresh failed, serving stale data: {e}")
+
+    async def get(self, *args):
+        """Return the cached catalog, loading it on first use."""
+        if self.data is None:
+            async with self._lock:
+                if self.data is None:
+                    await self._load(*args)
+            return self.data
+
+        if self.is_stale() and (
+            self._refresh_task is None or self._refresh_task.done()
+        ):
+            self._refresh_task = asyncio.create_task(self._refresh(*args))
+        return self.data
+
+    async def refresh(self, *args):
+        """Reload the catalog now and wait for the result."""
+        async with self._lock:
+            return await self._load(*args)
+
+    def prime(self, data):
+        """Seed the cache with data that should be served but revalidated."""
+        self.data = data
+        self.loaded_at = STALE
+        self._notify()
+
+    def invalidate(self):
+        """Mark the cached catalog as stale so the next read revalidates it."""
+        self.loaded_at = STALE
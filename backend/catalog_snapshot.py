@@ -0,0 +1,60 @@
+import json
+import time
+
+from storage import connect
+
+
+SNAPSHOT_DB = "catalog.sqlite3"
+SECTIONS = ("product_array", "product_weight_array", "taxes_array")
+
+
+def _connect():
+    conn = connect(SNAPSHOT_DB)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            saved_at REAL NOT NULL,
+            data TEXT NOT NULL
+        )
+        """)
+    return conn
+
+
+def save_snapshot(data: dict, version: int):
+    """Persist a built catalog as the last good snapshot."""
+    # Store each section as a list, JSON would turn the integer ids into strings
+    payload = json.dumps(
+        {section: list(data.get(section, {}).values()) for section in SECTIONS},
+        separators=(",", ":"),
+    )
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_snapshot (id, version, saved_at, data)"
+                " VALUES (1, ?, ?, ?)",
+                (version, time.time(), payload),
+            )
+    finally:
+        conn.close()
+
+
+def load_snapshot() -> tuple[dict, int] | None:
+    """Return (catalog data, version) of the last snapshot, if there is one."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT version, data FROM catalog_snapshot WHERE id = 1"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    version, payload = row
+    sections = json.loads(payload)
+    data = {
+        section: {item["id"]: item for item in sections.get(section, [])}
+        for section in SECTIONS
+    }
+    return data, version
@@ -0,0 +1,90 @@
+import hashlib
+
+import httpx
+
+
+class CatalogSync:
+    """Conditional fetching of OFN catalog endpoints.
+
+    Remembers the ETag / Last-Modified validators and a digest of the last
+    body for every URL. A 304 reply, or a 200 reply whose body hashes to the
+    same digest, is reported as unchanged and the previously parsed payload
+    is returned, so callers can skip rebuilding anything.
+
+    New validators and payloads are only staged by get_json. Callers
+    commit() them once the catalog built from them is in place, or
+    discard() them so the next sync fetches the same change again.
+    """
+
+    def __init__(self):
+        self.validators = {}
+        self.payloads = {}
+        self.pending = {}
+
+    async def get_json(self, client: httpx.AsyncClient, url: str, headers: dict):
+        """GET `url` and return (changed, payload)."""
+        validators = self.validators.get(url, {})
+        request_headers = dict(headers)
+        if url in self.payloads:
+            if validators.get("etag"):
+                request_headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                request_headers["If-Modified-Since"] = validators["last_modified"]
+
+        response = await client.get(url, headers=request_headers)
+        if response.status_code == 304 and url in self.payloads:
+            return False, self.payloads[url]
+        response.raise_for_status()
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        changed = validators.get("digest") != digest or url not in self.payloads
+        payload = response.json() if changed else self.payloads[url]
+        self.pending[url] = (
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "digest": digest,
+            },
+            payload,
+        )
+        return changed, payload
+
+    def commit(self):
+        """Keep the validators and payloads staged since the last commit."""
+        for url, (validators, payload) in self.pending.items():
+            self.validators[url] = validators
+            self.payloads[url] = payload
+        self.pending.clear()
+
+    def discard(self):
+        """Drop the staged validators and payloads."""
+        self.pending.clear()
+
+    def reset(self):
+        """Forget all validators so the next fetch is unconditional."""
+        self.validators.clear()
+        self.payloads.clear()
+        self.pending.clear()
+
+
+def diff_dicts(old: dict, new: dict) -> dict:
+    """Return the added, changed and removed entries between two id-keyed dicts."""
+    added = {}
+    changed = {}
+    for key, value in new.items():
+        if key not in old:
+            added[key] = value
+        elif old[key] != value:
+            changed[key] = value
+    removed = [key for key in old if key not in new]
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+def diff_catalog(old: dict, new: dict) -> dict | None:
+    """Per-variant diff of two built catalogs, or None if they are equal."""
+    diff = {}
+    for section in ("product_array", "product_weight_array", "taxes_array"):
+        section_diff = diff_dicts(old.get(section, {}), new.get(section, {}))
+        if any(section_diff.values()):
+            diff[section] = section_diff
+    return diff or None
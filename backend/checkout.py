@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+import uuid
+
+import httpx
+
+from draft_order import DRAFT_ORDERS
+from order import (
+    LineItemError,
+    SessionExpired,
+    TokenRejected,
+    create_ofn_order_from_session,
+)
+from tracing import TRACER
+
+
+CHECKOUT_WORKERS = int(os.environ.get("CHECKOUT_WORKERS", 2))
+# Finished jobs stay queryable this long
+CHECKOUT_JOB_TTL = 3600
+# What clients are told about a failure, the full error is only logged
+ERROR_CODES = (
+    (TimeoutError, "timeout"),
+    (LineItemError, "line_items_rejected"),
+    ((SessionExpired, TokenRejected), "ofn_session"),
+    (httpx.HTTPError, "ofn_unavailable"),
+)
+
+
+def error_code(error: Exception) -> str:
+    for types, code in ERROR_CODES:
+        if isinstance(error, types):
+            return code
+    return "checkout_failed"
+
+
+class CheckoutJob:
+    """One queued checkout and its progress."""
+
+    def __init__(self, session_id: str, args: tuple):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.args = args
+        self.subscribers = []
+        self.status = "queued"
+        self.stage = None
+        self.order = None
+        self.error = None
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "error": self.error,
+            "order": self.order,
+        }
+
+    def subscribe(self, notify):
+        """Send the job's further updates to `notify` as well."""
+        if notify is not None:
+            self.subscribers.append(notify)
+
+    async def emit(self, message: dict):
+        """Send `message` to every client that submitted the job."""
+        message = {**message, "job_id": self.id}
+        # Indexed so clients subscribing while we await still get the message
+        i = 0
+        while i < len(self.subscribers):
+            try:
+                await self.subscribers[i](message)
+            except Exception as e:
+                print(f"Failed to send checkout update for job {self.id}: {e}")
+                del self.subscribers[i]
+            else:
+                i += 1
+
+    async def progress(self, stage: str, status: str):
+        self.stage = stage
+        await self.emit({"type": "checkout_progress", "stage": stage, "status": status})
+
+
+class CheckoutQueue:
+    """Runs checkouts in the background on a fixed number of workers.
+
+    A session has at most one pending checkout; submitting again returns
+    the job already in progress and subscribes the new caller to it.
+    Results and failures are sent to every subscriber and kept for status
+    queries.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.jobs = {}
+
+    def submit(self, session_id: str, args: tuple, notify=None) -> CheckoutJob:
+        """Queue a checkout of `session_id`, `args` as for create_ofn_order_from_session."""
+        for job in self.jobs.values():
+            if job.session_id == session_id and job.finished_at is None:
+                job.subscribe(notify)
+                return job
+        self._expire()
+        job = CheckoutJob(session_id, args)
+        job.subscribe(notify)
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> CheckoutJob | None:
+        return self.jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - CHECKOUT_JOB_TTL
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self.jobs[job_id]
+
+    async def _execute(self, job: CheckoutJob):
+        job.status = "running"
+        order_id = await DRAFT_ORDERS.claim(job.session_id)
+        try:
+            with TRACER.trace("checkout", job_id=job.id, draft=order_id is not None):
+                job.order = await create_ofn_order_from_session(
+                    job.session_id, *job.args, progress=job.progress, order_id=order_id
+                )
+        except Exception as e:
+            if order_id is not None and job.stage in (None, "login"):
+                # The prepared order was not touched yet
+                DRAFT_ORDERS.recycle(order_id)
+            elif order_id is not None and job.stage == "line_items":
+                # Filled in but never paid, nobody is going to complete it
+                DRAFT_ORDERS.discard(order_id)
+            job.status = "failed"
+            job.error = error_code(e)
+            print(f"Checkout {job.id} failed at {job.stage}: {e!r}")
+            await job.emit(
+                {"type": "checkout_failed", "stage": job.stage, "error": job.error}
+            )
+        else:
+            job.status = "done"
+            print(f"Checkout {job.id} created order {job.order['order_id']}.")
+            await job.emit({"type": "init_checkout", "order": job.order})
+        finally:
+            job.finished_at = time.time()
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._execute(job)
+            finally:
+                self.queue.task_done()
+
+    async def run(self):
+        """Run the worker pool forever."""
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+
+
+CHECKOUT_JOBS = CheckoutQueue(CHECKOUT_WORKERS)
@@ -0,0 +1,24 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library
+    orjson = None
+
+
+def loads(data):
+    """Decode a JSON message given as str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode(obj) -> bytes:
+    """UTF-8 JSON of `obj`, dict keys need not be strings."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dumps(obj) -> str:
+    return encode(obj).decode()
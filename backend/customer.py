@@ -1,59 +1,163 @@
-import httpx
+import asyncio
+import os
 import re
+import time
+
+from transport import get_client
+
 
 INSTANCE_URL = "https://openfoodnetwork.de"
+CUSTOMER_REFRESH_INTERVAL = float(os.environ.get("CUSTOMER_REFRESH_INTERVAL", 300))
+# Unknown codes trigger an early refresh at most this often (new members)
+CUSTOMER_MISS_REFRESH_INTERVAL = float(
+    os.environ.get("CUSTOMER_MISS_REFRESH_INTERVAL", 30)
+)
+CODE_TAG_PATTERN = re.compile(r"code[:=]([^\s;,]+)", re.IGNORECASE)
+CUSTOMER_PAGE_SIZE = int(os.environ.get("CUSTOMER_PAGE_SIZE", 100))
+# Only these customer attributes are kept, everything else is dropped per page
+CUSTOMER_FIELDS = (
+    "first_name",
+    "last_name",
+    "email",
+    "tags",
+    "billing_address",
+    "shipping_address",
+)
 
 
-# Fetch customers from Open Food Network API
-def fetch_customers(ofn_api_key: str) -> list[dict]:
-    """Fetch customers list from Open Food Network API using httpx."""
+async def iter_customer_pages(ofn_api_key: str, per_page: int = CUSTOMER_PAGE_SIZE):
+    """Yield the `data` list of each page of /api/v1/customers, raising on failure."""
     headers = {
         "Accept": "application/json;charset=UTF-8",
         "Content-Type": "application/json",
     }
-    url = f"{INSTANCE_URL}/api/v1/customers?token={ofn_api_key}"
-    try:
-        with httpx.Client() as client:
-            response = client.get(url, headers=headers)
-            response.raise_for_status()
-            raw = response.json()
-            customers = []
-            for item in raw.get("data", []):
-                attrs = item.get("attributes", {})
-                # Merge id and enterprise_id from relationships if needed
-                attrs["id"] = attrs.get("id", item.get("id"))
-                attrs["enterprise_id"] = attrs.get("enterprise_id", None)
-                customers.append(attrs)
-            return customers
-    except httpx.RequestError as e:
-        print(f"Failed to fetch customers: {e}")
-        return []
-
-
-def find_customer_by_code(code: str, customers: list[dict]) -> dict:
-    """Find a customer by code in their tags."""
-    pattern = re.compile(rf"code[:=]{re.escape(code)}(\b|;|$)", re.IGNORECASE)
-    for customer in customers:
-        code_found = False
-        iban = ""
-        # Search for code and IBAN in tags
-        for tag in customer.get("tags", []):
-            if pattern.search(tag):
-                code_found = True
-            if tag.lower().startswith("iban:"):
-                iban = tag.split(":", 1)[1].strip()
-        if code_found:
-            name = f"{customer.get('first_name', '')} {customer.get('last_name', '')}".strip()
-            return {
-                "exist": True,
-                "id": customer.get("id"),
-                "code": code,
-                "full_name": name,
-                "first_name": customer.get("first_name", ""),
-                "last_name": customer.get("last_name", ""),
-                "email": customer.get("email", ""),
-                "iban": iban,
-                "bill_address": customer.get("billing_address", {}),
-                "ship_address": customer.get("shipping_address", {}),
+    url = f"{INSTANCE_URL}/api/v1/customers"
+    page = 1
+    client = get_client()
+    while True:
+        params = {"token": ofn_api_key, "page": page, "per_page": per_page}
+        response = await client.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        raw = response.json()
+        data = raw.get("data", [])
+        pagination = raw.get("meta", {}).get("pagination", {})
+        has_next = bool(raw.get("links", {}).get("next")) or (
+            pagination.get("pages", 0) > page
+        )
+        del raw, response
+        yield data
+        if not data or not has_next:
+            return
+        page += 1
+
+
+async def iter_customers(ofn_api_key: str, per_page: int = CUSTOMER_PAGE_SIZE):
+    """Yield slim customer dicts page by page from Open Food Network API."""
+    async for data in iter_customer_pages(ofn_api_key, per_page):
+        for item in data:
+            attrs = item.get("attributes", {})
+            customer = {
+                field: attrs[field] for field in CUSTOMER_FIELDS if field in attrs
             }
-    return {"exist": False}
+            # Merge id and enterprise_id from relationships if needed
+            customer["id"] = attrs.get("id", item.get("id"))
+            customer["enterprise_id"] = attrs.get("enterprise_id", None)
+            yield customer
+
+
+def customer_record(customer: dict, code: str, iban: str) -> dict:
+    name = f"{customer.get('first_name', '')} {customer.get('last_name', '')}".strip()
+    return {
+        "exist": True,
+        "id": customer.get("id"),
+        "code": code,
+        "full_name": name,
+        "first_name": customer.get("first_name", ""),
+        "last_name": customer.get("last_name", ""),
+        "email": customer.get("email", ""),
+        "iban": iban,
+        "bill_address": customer.get("billing_address", {}),
+        "ship_address": customer.get("shipping_address", {}),
+    }
+
+
+def add_customer_codes(by_code: dict, customer: dict):
+    """Parse `code:`/`code=` and `iban:` tags of a customer into `by_code`."""
+    codes = []
+    iban = ""
+    for tag in customer.get("tags", []):
+        codes.extend(CODE_TAG_PATTERN.findall(tag))
+        if tag.lower().startswith("iban:"):
+            iban = tag.split(":", 1)[1].strip()
+    for code in codes:
+        by_code.setdefault(code.lower(), (customer, iban))
+
+
+class CustomerDirectory:
+    """Card code -> customer lookups, refreshed from OFN in the background."""
+
+    def __init__(self, refresh_interval: float, miss_refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self.by_code = None
+        self.loaded_at = 0.0
+        self.refresh_failed = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def healthy(self) -> bool:
+        """Loaded, and the last refresh from OFN succeeded."""
+        return self.by_code is not None and not self.refresh_failed
+
+    async def refresh(self, ofn_api_key: str, max_age: float = 0.0):
+        """Reload the directory unless it is younger than `max_age` seconds."""
+        async with self._lock:
+            if self.by_code is not None and time.monotonic() - self.loaded_at < max_age:
+                return
+            # Index straight off the page stream, only card holders are kept
+            by_code = {}
+            try:
+                async for customer in iter_customers(ofn_api_key):
+                    add_customer_codes(by_code, customer)
+            except Exception:
+                self.refresh_failed = True
+                raise
+            self.by_code = by_code
+            self.refresh_failed = False
+            self.loaded_at = time.monotonic()
+            print(f"Customer directory refreshed: {len(self.by_code)} card codes.")
+
+    async def lookup(self, ofn_api_key: str, code: str) -> dict:
+        """Return the customer record for a card code, or {"exist": False}."""
+        code = str(code or "")
+        try:
+            # Unknown codes may belong to a card registered since the last refresh
+            if self.by_code is None or code.lower() not in self.by_code:
+                await self.refresh(ofn_api_key, max_age=self.miss_refresh_interval)
+        except Exception as e:
+            print(f"Failed to fetch customers: {e}")
+
+        return self.find(code)
+
+    def find(self, code: str) -> dict:
+        """Like lookup(), but only from what is loaded, never fetching."""
+        code = str(code or "")
+        entry = (self.by_code or {}).get(code.lower())
+        if entry is None:
+            return {"exist": False}
+        customer, iban = entry
+        return customer_record(customer, code, iban)
+
+    async def run(self, ofn_api_key: str):
+        """Keep the directory fresh, meant to run as a background task."""
+        while True:
+            try:
+                await self.refresh(ofn_api_key)
+            except Exception as e:
+                print(f"Failed to refresh customer directory: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+
+CUSTOMER_DIRECTORY = CustomerDirectory(
+    CUSTOMER_REFRESH_INTERVAL, CUSTOMER_MISS_REFRESH_INTERVAL
+)
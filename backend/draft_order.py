@@ -0,0 +1,255 @@
+import asyncio
+import os
+import time
+
+from order import (
+    CHECKOUT_STAGE_TIMEOUT,
+    dispose_order,
+    get_admin_session,
+    prepare_order,
+)
+from session_backend import SESSION_BACKEND
+from storage import connect
+from tracing import TRACER
+
+
+DRAFT_DB = "drafts.sqlite3"
+# Recycled drafts older than this are cancelled instead of handed out again
+DRAFT_ORDER_MAX_AGE = float(os.environ.get("DRAFT_ORDER_MAX_AGE", 3600))
+DRAFT_CANCEL_INTERVAL = float(os.environ.get("DRAFT_CANCEL_INTERVAL", 300))
+
+
+class DraftOrder:
+    def __init__(self, customer_id, task: asyncio.Future, created_at=None):
+        self.customer_id = customer_id
+        self.task = task
+        self.order_id = None
+        self.created_at = created_at or time.time()
+
+
+class DraftOrders:
+    """OFN orders created and filled in while the customer is still shopping.
+
+    prepare() starts a background task creating the order as soon as the
+    customer has logged in, so checkout only has to add line items and the
+    payment. Drafts of sessions that end without a checkout are kept as
+    spares and reused, with the new customer filled in, by the next login.
+
+    Every order id is written to SQLite as soon as the order exists, so
+    drafts survive a restart. Drafts and spares that get too old, whatever
+    became of their session, and drafts that can no longer be used are
+    cancelled, or emptied if never completed, in OFN by run().
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.drafts = {}
+        self.spares = []
+        self.to_cancel = set()
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = connect(self.filename)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS draft_orders (
+                    order_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    session_id TEXT,
+                    customer_id TEXT,
+                    created_at REAL NOT NULL
+                )
+                """)
+        return self._conn
+
+    def _save(self, order_id: str, state: str, created_at: float, draft_of=None):
+        """Persist the order's state, `draft_of` is (session id, customer id)."""
+        session_id, customer_id = draft_of or (None, None)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO draft_orders"
+                " (order_id, state, session_id, customer_id, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (order_id, state, session_id, customer_id, created_at),
+            )
+
+    def _forget(self, order_id: str):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM draft_orders WHERE order_id = ?", (order_id,)
+            )
+
+    async def start(self):
+        """Bring back the drafts of sessions restored after a restart.
+
+        Drafts whose session or customer is gone, or whose customer was
+        not filled in yet, become spares.
+        """
+        try:
+            rows = self.conn.execute(
+                "SELECT order_id, state, session_id, customer_id, created_at"
+                " FROM draft_orders"
+            ).fetchall()
+        except Exception as e:
+            print(f"Failed to restore draft orders: {e}")
+            return
+        for order_id, state, session_id, customer_id, created_at in rows:
+            if state == "cancel":
+                self.to_cancel.add(order_id)
+            elif state == "spare":
+                self.recycle(order_id, created_at)
+            elif state == "draft":
+                # The stored reference is enough, resolving it may need OFN
+                customer = await SESSION_BACKEND.get_customer_reference(session_id)
+                if customer.get("exist") and str(customer.get("id")) == customer_id:
+                    task = asyncio.get_running_loop().create_future()
+                    task.set_result(order_id)
+                    draft = DraftOrder(customer.get("id"), task, created_at)
+                    draft.order_id = order_id
+                    self.drafts[session_id] = draft
+                else:
+                    self.recycle(order_id, created_at)
+            else:
+                self.recycle(order_id, created_at)
+        if rows:
+            print(f"Restored {len(rows)} draft orders.")
+
+    def prepare(self, session_id: str, customer_data: dict, admin_args: tuple):
+        """Start a draft for the session's customer, `admin_args` as for prepare_order."""
+        if not customer_data.get("exist"):
+            self.release(session_id)
+            return
+        draft = self.drafts.get(session_id)
+        if draft is not None and draft.customer_id == customer_data.get("id"):
+            return
+        self.release(session_id)
+        draft_of = (session_id, str(customer_data.get("id")))
+        spare = self._take_spare()
+        if spare is not None:
+            order_id, created_at = spare
+            self._save(order_id, "drafting", created_at, draft_of)
+        else:
+            order_id, created_at = None, time.time()
+        draft = DraftOrder(customer_data.get("id"), None, created_at)
+        draft.order_id = order_id
+
+        def created(order_id):
+            draft.order_id = order_id
+            self._save(order_id, "drafting", created_at, draft_of)
+
+        def prepared(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is None:
+                self._save(task.result(), "draft", created_at, draft_of)
+
+        draft.task = asyncio.create_task(
+            self._prepare(admin_args, customer_data, order_id, created)
+        )
+        draft.task.add_done_callback(prepared)
+        draft.task.add_done_callback(self._log_failure)
+        self.drafts[session_id] = draft
+
+    async def _prepare(self, admin_args: tuple, customer_data: dict, spare, created):
+        with TRACER.trace("draft_order", recycled=spare is not None):
+            return await prepare_order(
+                *admin_args, customer_data, order_id=spare, created=created
+            )
+
+    def _take_spare(self) -> tuple | None:
+        cutoff = time.time() - DRAFT_ORDER_MAX_AGE
+        while self.spares:
+            order_id, created_at = self.spares.pop()
+            if created_at >= cutoff:
+                return order_id, created_at
+            self.discard(order_id)
+        return None
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Failed to prepare draft order: {task.exception()}")
+
+    def recycle(self, order_id: str, created_at: float | None = None):
+        """Offer an unused order to the next customer."""
+        created_at = created_at or time.time()
+        if created_at < time.time() - DRAFT_ORDER_MAX_AGE:
+            self.discard(order_id)
+            return
+        self.spares.append((order_id, created_at))
+        self._save(order_id, "spare", created_at)
+
+    def discard(self, order_id: str):
+        """Cancel the order in OFN with the next run() pass."""
+        self.to_cancel.add(order_id)
+        self._save(order_id, "cancel", time.time())
+
+    def _recycle_when_done(self, draft: DraftOrder):
+        def recycle(task: asyncio.Future):
+            if not task.cancelled() and task.exception() is None:
+                self.recycle(task.result(), draft.created_at)
+            elif draft.order_id is not None:
+                # Created, but the customer may be half filled in
+                self.discard(draft.order_id)
+
+        draft.task.add_done_callback(recycle)
+
+    def release(self, session_id: str):
+        """Drop the session's draft, keeping the order as a spare once it exists."""
+        draft = self.drafts.pop(session_id, None)
+        if draft is not None:
+            self._recycle_when_done(draft)
+
+    async def claim(self, session_id: str) -> str | None:
+        """Return the session's prepared order id, waiting for it if needed."""
+        draft = self.drafts.pop(session_id, None)
+        if draft is None:
+            return None
+        try:
+            order_id = await asyncio.wait_for(
+                asyncio.shield(draft.task), CHECKOUT_STAGE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            # Too slow for this checkout, the next customer can have it
+            self._recycle_when_done(draft)
+        except Exception:
+            if draft.order_id is not None:
+                self.discard(draft.order_id)
+        else:
+            # From here on the order belongs to the checkout
+            self._forget(order_id)
+            return order_id
+        return None
+
+    def _expire(self):
+        cutoff = time.time() - DRAFT_ORDER_MAX_AGE
+        # The session may have been abandoned without ever timing out here
+        for session_id, draft in list(self.drafts.items()):
+            if draft.created_at < cutoff:
+                self.release(session_id)
+        for order_id, created_at in list(self.spares):
+            if created_at < cutoff:
+                self.spares.remove((order_id, created_at))
+                self.discard(order_id)
+
+    async def run(
+        self, ofn_api_key: str, ofn_admin_email: str, ofn_admin_password: str
+    ):
+        """Cancel or empty expired and discarded orders in OFN, runs forever.
+
+        An order is only forgotten once the OFN API confirms the change.
+        """
+        admin = get_admin_session(ofn_admin_email, ofn_admin_password)
+        while True:
+            self._expire()
+            for order_id in list(self.to_cancel):
+                try:
+                    await dispose_order(admin, ofn_api_key, order_id)
+                except Exception as e:
+                    print(f"Failed to dispose of draft order {order_id}: {e}")
+                    continue
+                self.to_cancel.discard(order_id)
+                self._forget(order_id)
+                print(f"Disposed of unused draft order {order_id}.")
+            await asyncio.sleep(DRAFT_CANCEL_INTERVAL)
+
+
+DRAFT_ORDERS = DraftOrders(DRAFT_DB)
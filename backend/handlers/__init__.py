@@ -0,0 +1,17 @@
+"""Websocket message handlers, registered by message type on import."""
+
+from handlers import carts, checkouts, customers, entrance, products, status
+from handlers.registry import HANDLERS, dispatch, handler, send
+
+__all__ = [
+    "HANDLERS",
+    "carts",
+    "checkouts",
+    "customers",
+    "dispatch",
+    "entrance",
+    "handler",
+    "products",
+    "send",
+    "status",
+]
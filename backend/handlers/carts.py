@@ -0,0 +1,106 @@
+from handlers.registry import ID, NUMBER, PRICE, handler, send
+from session_backend import SESSION_BACKEND
+
+
+async def update_last_activity(session_id):
+    await SESSION_BACKEND.touch(session_id)
+
+
+async def change_cart(websocket, msg, session_id, change):
+    """Apply `change(cart)`, which returns the changed line keys, and reply."""
+
+    def apply(cart):
+        base_version = cart.version
+        return cart, base_version, change(cart)
+
+    cart, base_version, keys = await SESSION_BACKEND.update_cart(session_id, apply)
+    await send_cart_update(websocket, msg, cart, base_version, keys)
+
+
+async def send_cart_update(websocket, msg, cart, base_version, keys):
+    """Send the cart after a change.
+
+    Clients that send the `cart_version` they hold get a cart_patch with just
+    the changed lines, or a full snapshot to resync if their version is not
+    the one the change was applied to. Other clients get the whole cart.
+    """
+    client_version = msg.get("cart_version")
+    if client_version is None:
+        message = {"type": "cart", "cart": cart.items()}
+    elif client_version == base_version:
+        message = cart.patch_message(base_version, keys)
+    else:
+        message = cart.snapshot_message()
+    await send(websocket, message)
+
+
+@handler("get_cart", optional={"cart_version": int})
+async def get_cart(websocket, session_id, msg):
+    cart = await SESSION_BACKEND.get_cart(session_id, fresh=True)
+    if "cart_version" in msg:
+        message = cart.snapshot_message()
+    else:
+        message = {"type": "cart", "cart": cart.items()}
+    await send(websocket, message)
+
+
+@handler(
+    "add_to_cart",
+    required={"id": ID, "name": str, "price": PRICE},
+    optional={
+        "quantity": NUMBER,
+        # Display label of the weighing, like "0.340 kg"
+        "gramm": (int, float, str),
+        "img": str,
+        "category_id": ID,
+        "category_name": str,
+        "cart_version": int,
+    },
+)
+async def add_to_cart(websocket, session_id, msg):
+    await update_last_activity(session_id)
+    product_data = {
+        "id": msg["id"],
+        "name": msg["name"],
+        "price": msg["price"],
+        "img": msg.get("img"),
+        "category_id": msg.get("category_id"),
+        "category_name": msg.get("category_name"),
+    }
+
+    # Add quantity and gramm for weighted products
+    if "quantity" in msg:
+        product_data["quantity"] = msg["quantity"]
+    if "gramm" in msg:
+        product_data["gramm"] = msg["gramm"]
+
+    await change_cart(websocket, msg, session_id, lambda cart: [cart.add(product_data)])
+
+
+@handler(
+    "update_quantity",
+    required={"id": ID, "quantity": NUMBER},
+    optional={"cart_version": int},
+)
+async def update_quantity(websocket, session_id, msg):
+    await update_last_activity(session_id)
+    await change_cart(
+        websocket,
+        msg,
+        session_id,
+        lambda cart: cart.update_quantity(msg["id"], msg["quantity"]),
+    )
+
+
+@handler("remove_item", required={"id": ID}, optional={"cart_version": int})
+async def remove_item(websocket, session_id, msg):
+    await update_last_activity(session_id)
+    await change_cart(websocket, msg, session_id, lambda cart: cart.remove(msg["id"]))
+
+
+@handler("delete_cart")
+async def delete_cart(websocket, session_id, msg):
+    cart = await SESSION_BACKEND.update_cart(
+        session_id, lambda cart: cart.clear() or cart
+    )
+    await send(websocket, {"type": "cart_deleted", "version": cart.version})
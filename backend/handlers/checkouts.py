@@ -0,0 +1,42 @@
+import settings
+from checkout import CHECKOUT_JOBS
+from handlers.registry import handler, send
+from session_backend import SESSION_BACKEND
+
+
+# Checkout logic, runs as a background job reporting its progress
+@handler("checkout")
+async def checkout(websocket, session_id, msg):
+    customer_data = await SESSION_BACKEND.get_customer(session_id)
+    job = CHECKOUT_JOBS.submit(
+        session_id,
+        settings.checkout_args(customer_data),
+        notify=lambda message: send(websocket, message),
+    )
+    await send(websocket, {"type": "checkout_started", "job_id": job.id})
+
+
+@handler("checkout_status", optional={"job_id": str})
+async def checkout_status(websocket, session_id, msg):
+    job = CHECKOUT_JOBS.get(msg.get("job_id"))
+    if job is None:
+        message = {
+            "type": "checkout_status",
+            "job_id": msg.get("job_id"),
+            "status": "unknown",
+        }
+    else:
+        message = {"type": "checkout_status", **job.to_dict()}
+    await send(websocket, message)
+
+
+# Get confirmation msg from db
+@handler("get_confirmation")
+async def get_confirmation(websocket, session_id, msg):
+    confirmation = msg.get("confirmation")
+    # TODO: Get the value from the IQ database
+    value = "Your confirmation message here"
+    await send(
+        websocket,
+        {"type": "confirmation", "confirmation": confirmation, "value": value},
+    )
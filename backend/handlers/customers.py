@@ -0,0 +1,35 @@
+import settings
+from customer import CUSTOMER_DIRECTORY
+from draft_order import DRAFT_ORDERS
+from handlers.registry import ID, handler, send
+from session_backend import SESSION_BACKEND
+
+
+# Login (card scan listener) POS
+@handler("login")
+async def login(websocket, session_id, msg):
+    # pyscard needs the PC/SC libraries, only import it where a reader is used
+    from smartcard.System import readers
+
+    from card import get_card_uid_async
+
+    all_readers = readers()
+    if len(all_readers) > 1:
+        device = str(all_readers[1])
+    else:
+        device = str(all_readers[0])
+    card_uid = await get_card_uid_async(device)
+    await send(websocket, {"type": "customer_code", "code": card_uid})
+
+
+# Check code, log in the shopping cart
+@handler("check_customer_code", required={"code": ID})
+async def check_customer_code(websocket, session_id, msg):
+    customer_data = await CUSTOMER_DIRECTORY.lookup(settings.OFN_API_KEY, msg["code"])
+    # Save customer data for this session
+    await SESSION_BACKEND.set_customer(session_id, customer_data)
+    # Start the inactivity timeout, which also releases the draft order
+    await SESSION_BACKEND.touch(session_id)
+    # Create the OFN order while the customer shops
+    DRAFT_ORDERS.prepare(session_id, customer_data, settings.draft_args())
+    await send(websocket, {"type": "customer_code_checked", **customer_data})
@@ -0,0 +1,70 @@
+import os
+
+import settings
+from customer import CUSTOMER_DIRECTORY
+from handlers.registry import ID, handler, send
+from outbox import OUTBOX
+from rate_limit import ExpiringSet, RateLimiter
+from relay import trigger_relay
+
+
+OPEN_DOOR_MIN_INTERVAL = float(os.environ.get("OPEN_DOOR_MIN_INTERVAL", 5))
+UNKNOWN_CODE_TTL = float(os.environ.get("UNKNOWN_CODE_TTL", 60))
+DENIED_ENTRANCE_WINDOW = float(os.environ.get("DENIED_ENTRANCE_WINDOW", 300))
+
+OPEN_DOOR_LIMITER = RateLimiter(OPEN_DOOR_MIN_INTERVAL)
+UNKNOWN_CODES = ExpiringSet(UNKNOWN_CODE_TTL)
+DENIED_ENTRANCES = ExpiringSet(DENIED_ENTRANCE_WINDOW)
+
+
+# Open door (card scan listener) Entrance
+@handler("open_door", required={"code": ID})
+async def open_door(websocket, session_id, msg):
+    code = msg["code"]
+    # A card held at the reader repeats open_door about every second
+    if not OPEN_DOOR_LIMITER.allow(code):
+        await send(websocket, {"type": "open_door", "status": "RATE_LIMITED"})
+        return
+
+    timeout = int(settings.TIMEOUT_RELAY)
+    trigger_relay(timeout)
+    await send(websocket, {"type": "open_door", "status": "OK"})
+
+    is_entrance = True
+    customer_firstname = ""
+    customer_lastname = ""
+
+    if code in UNKNOWN_CODES:
+        is_entrance = False
+    else:
+        try:
+            customer_data = await CUSTOMER_DIRECTORY.lookup(settings.OFN_API_KEY, code)
+            customer_firstname = customer_data.get("first_name", "")
+            customer_lastname = customer_data.get("last_name", "")
+            # A miss only means "unknown card" if the directory could be read
+            if not customer_data.get("exist") and CUSTOMER_DIRECTORY.healthy:
+                UNKNOWN_CODES.add(code)
+        except Exception as e:
+            print(f"Error fetching customer data: {e}")
+            is_entrance = False
+
+    # If customer_firstname/lastname are empty, treat as not granted
+    if not customer_firstname and not customer_lastname:
+        is_entrance = False
+
+    # Log a denied card once per window, not on every retry
+    if not is_entrance:
+        if code in DENIED_ENTRANCES:
+            print(f"Denied entrance for {code} already logged, skipping.")
+            return
+        DENIED_ENTRANCES.add(code)
+
+    payload = {
+        "customer_firstname": customer_firstname,
+        "customer_lastname": customer_lastname,
+        "rfid_card_id": code,
+        "is_entrance": is_entrance,
+        "ofn_hub_id": settings.OFN_SHOP_ID,
+    }
+    OUTBOX.enqueue("entrance_history", payload)
+    print(f"Entrance history queued for IQ Tool (is_entrance={is_entrance}).")
@@ -0,0 +1,108 @@
+import re
+
+import serial
+
+import settings
+from handlers.registry import ID, handler, send
+from product import get_catalog
+from scale import get_scale_port
+
+
+BAUDRATE = 9600
+
+
+# Products load
+@handler("load_products", optional={"version": int})
+async def load_products(websocket, session_id, msg):
+    catalog = await get_catalog(settings.OFN_API_KEY, settings.OFN_SHOP_ID)
+    # Clients that send the catalog version they already have only receive
+    # what changed since then. Payloads are serialized once per catalog
+    # version.
+    client_version = msg.get("version")
+    if client_version is not None and client_version == catalog.version:
+        await send(
+            websocket, {"type": "products_unchanged", "version": catalog.version}
+        )
+    elif (
+        client_version is not None
+        and catalog.diff
+        and client_version == catalog.version - 1
+    ):
+        await websocket.send(catalog.diff_payload(), text=True)
+    else:
+        await websocket.send(catalog.payload(), text=True)
+
+
+@handler("check_product_code", optional={"code": ID})
+async def check_product_code(websocket, session_id, msg):
+    code = str(msg.get("code", "")).replace("Shift", "").replace("Meta", "").lower()
+    catalog = await get_catalog(settings.OFN_API_KEY, settings.OFN_SHOP_ID)
+    p = catalog.index.find_by_sku(code)
+    if p:
+        found = {
+            "exist": True,
+            "id": p.id,
+            "name": p.name,
+            "price": p.price,
+            "img": p.image,
+            "category_id": p.category_id,
+            "category_name": p.category_name,
+        }
+        await send(websocket, {"type": "search_product_code", **found})
+        return
+
+    # If not found by code, try by name (fallback)
+    name = code  # treat the code as a possible name
+    found_name = catalog.index.find_by_name(name)
+    if found_name:
+        response = {
+            "type": "search_product_name",
+            "exist": True,
+            "product": {
+                "id": found_name.id,
+                "name": found_name.name,
+                "price": found_name.price,
+                "image": found_name.image,
+                "category_id": found_name.category_id,
+                "category_name": found_name.category_name,
+            },
+            "name": name,
+        }
+    else:
+        response = {"type": "search_product_name", "exist": False, "name": name}
+    await send(websocket, response)
+
+
+# Ranked name search over all products
+@handler("search_products", optional={"query": str, "limit": int})
+async def search_products(websocket, session_id, msg):
+    query = msg.get("query") or ""
+    limit = msg.get("limit")
+    limit = 10 if limit is None else min(limit, 50)
+    catalog = await get_catalog(settings.OFN_API_KEY, settings.OFN_SHOP_ID)
+    await send(
+        websocket,
+        {
+            "type": "search_products",
+            "query": query,
+            "results": catalog.search.search(query, limit),
+        },
+    )
+
+
+# Weight (for weighted products)
+@handler("weight")
+async def weight(websocket, session_id, msg):
+    port = get_scale_port()
+    if not port:
+        await send(websocket, {"type": "weight", "error": "Scale not found"})
+        return
+    try:
+        with serial.Serial(port, BAUDRATE, timeout=1) as ser:
+            line = ser.readline().decode(errors="ignore")
+            if line:
+                match = re.search(r"([-+]?\d*\.\d+|\d+)", line)
+                if match:
+                    await send(websocket, {"type": "weight", "value": match.group(0)})
+    except Exception as e:
+        await send(websocket, {"type": "weight", "error": str(e)})
@@ -0,0 +1,118 @@
+from decimal import Decimal, InvalidOperation
+
+from codec import dumps
+
+
+def numeric_str(value) -> bool:
+    """A string holding a finite decimal number, like "1.10"."""
+    if not isinstance(value, str):
+        return False
+    try:
+        return Decimal(value).is_finite()
+    except InvalidOperation:
+        return False
+
+
+# Field types for message schemas, a check function stands for a type
+ID = (int, str)
+NUMBER = (int, float)
+PRICE = (int, float, numeric_str)
+
+HANDLERS = {}
+
+
+class Handler:
+    """A message handler and the schema of the messages it accepts.
+
+    `required` and `optional` map field names to a type or tuple of types,
+    optional fields may also be missing or null. A function in place of a
+    type accepts the values it returns True for.
+    """
+
+    def __init__(self, func, required: dict, optional: dict):
+        self.func = func
+        self.required = required
+        self.optional = optional
+
+    def validate(self, msg: dict) -> list[str]:
+        """Return what is wrong with the message, nothing if it is valid."""
+        errors = []
+        for name, types in self.required.items():
+            if name not in msg or msg[name] is None:
+                errors.append(f"{name} is required")
+            elif not _is_instance(msg[name], types):
+                errors.append(f"{name} has the wrong type")
+        for name, types in self.optional.items():
+            value = msg.get(name)
+            if value is not None and not _is_instance(value, types):
+                errors.append(f"{name} has the wrong type")
+        return errors
+
+
+def _is_instance(value, types: tuple) -> bool:
+    # JSON true / false must not pass as numbers
+    if isinstance(value, bool):
+        return bool in types
+    return any(
+        isinstance(value, kind) if isinstance(kind, type) else kind(value)
+        for kind in types
+    )
+
+
+def _types(schema: dict | None) -> dict:
+    return {
+        name: types if isinstance(types, tuple) else (types,)
+        for name, types in (schema or {}).items()
+    }
+
+
+def handler(
+    message_type: str, required: dict | None = None, optional: dict | None = None
+):
+    """Register the decorated `async def f(websocket, session_id, msg)`."""
+
+    def register(func):
+        if message_type in HANDLERS:
+            raise Exception(f"Duplicate handler for {message_type!r}.")
+        HANDLERS[message_type] = Handler(func, _types(required), _types(optional))
+        return func
+
+    return register
+
+
+async def send(websocket, message: dict):
+    await websocket.send(dumps(message))
+
+
+async def dispatch(websocket, session_id: str, msg: dict):
+    """Run the handler registered for the message type.
+
+    Unknown types are ignored as before, messages that do not match the
+    schema get an invalid_message reply instead of reaching the handler.
+    A handler that fails is logged and answered the same way, so one bad
+    message does not end the connection.
+    """
+    message_type = msg.get("type")
+    entry = HANDLERS.get(message_type) if isinstance(message_type, str) else None
+    if entry is None:
+        print(f"No handler for message type {message_type!r}.")
+        return
+    errors = entry.validate(msg)
+    if errors:
+        await send(
+            websocket,
+            {"type": "invalid_message", "message_type": message_type, "errors": errors},
+        )
+        return
+    try:
+        await entry.func(websocket, session_id, msg)
+    except Exception as e:
+        print(f"Handler for {message_type!r} failed: {e!r}")
+        await send(
+            websocket,
+            {
+                "type": "invalid_message",
+                "message_type": message_type,
+                "errors": ["message could not be handled"],
+            },
+        )
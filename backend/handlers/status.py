@@ -0,0 +1,29 @@
+import settings
+from handlers.registry import handler, send
+from outbox import OUTBOX
+from product import get_catalog, invalidate_products
+from tracing import TRACE_BUFFER_SIZE, TRACER
+
+
+# Webhook outbox metrics
+@handler("outbox_status")
+async def outbox_status(websocket, session_id, msg):
+    await send(websocket, {"type": "outbox_status", **OUTBOX.stats()})
+
+
+# Checkout latency histograms and recent traces
+@handler("traces", optional={"limit": int})
+async def traces(websocket, session_id, msg):
+    limit = msg.get("limit")
+    if limit is None:
+        limit = TRACE_BUFFER_SIZE
+    await send(websocket, {"type": "traces", **TRACER.snapshot(limit)})
+
+
+# Revalidate the product catalog against OFN now instead of after its TTL
+@handler("invalidate_products")
+async def invalidate_catalog(websocket, session_id, msg):
+    invalidate_products()
+    # A read of the stale catalog starts the background refresh
+    catalog = await get_catalog(settings.OFN_API_KEY, settings.OFN_SHOP_ID)
+    await send(websocket, {"type": "products_invalidated", "version": catalog.version})
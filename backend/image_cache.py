@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import httpx
+
+from storage import DATA_DIR
+from transport import get_client
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are optional, originals are served without Pillow
+    Image = None
+
+
+INSTANCE_URL = "https://openfoodnetwork.de"
+IMAGE_CACHE_DIR = os.path.join(DATA_DIR, "images")
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 200 * 1024**2))
+IMAGE_BASE_URL = os.environ.get("IMAGE_BASE_URL", "http://localhost:8765/images")
+IMAGE_ROUTE = "/images/"
+THUMBNAIL_WIDTHS = (64, 128, 256, 512)
+
+
+class ImageCache:
+    """Size-bounded LRU disk cache for OFN product images.
+
+    Images are addressed by their path on the OFN instance, which is also
+    the path of the local URL they are served from, so any cached or
+    snapshotted catalog can be served without extra bookkeeping. Only the
+    paths of the current catalog, set with allow(), are downloaded.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.allowed = frozenset()
+        self._lock = threading.Lock()
+        self._prefetch_task = None
+        self._scan()
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                files.append((stat.st_atime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    def _filename(self, path: str, width: int | None = None) -> str:
+        digest = hashlib.sha1(path.encode()).hexdigest()
+        if width:
+            return f"{digest}_{width}.jpg"
+        ext = os.path.splitext(path)[1].lower()
+        return digest + (ext if len(ext) <= 5 else "")
+
+    def _store(self, filename: str, content: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        target = os.path.join(self.directory, filename)
+        tmp = target + ".part"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, target)
+        with self._lock:
+            self.total_bytes += len(content) - self.entries.pop(filename, 0)
+            self.entries[filename] = len(content)
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            filename, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, filename: str) -> bytes | None:
+        if filename not in self.entries:
+            return None
+        try:
+            with open(os.path.join(self.directory, filename), "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.total_bytes -= self.entries.pop(filename, 0)
+            return None
+        with self._lock:
+            if filename in self.entries:
+                self.entries.move_to_end(filename)
+        return content
+
+    async def fetch(self, path: str) -> bytes:
+        """Return the original image for an OFN path, downloading it on a miss."""
+        filename = self._filename(path)
+        content = self._read(filename)
+        if content is None:
+            response = await get_client().get(
+                INSTANCE_URL + path, follow_redirects=True
+            )
+            response.raise_for_status()
+            content = response.content
+            self._store(filename, content)
+        return content
+
+    def _thumbnail(self, filename: str, original: bytes, width: int) -> bytes:
+        image = Image.open(io.BytesIO(original))
+        image.thumbnail((width, width))
+        out = io.BytesIO()
+        image.convert("RGB").save(out, "JPEG", quality=85)
+        thumbnail = out.getvalue()
+        self._store(filename, thumbnail)
+        return thumbnail
+
+    async def load(self, path: str, width: int | None = None) -> tuple[bytes, str]:
+        """Return (content, content type), resized to `width` if possible."""
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if width not in THUMBNAIL_WIDTHS or Image is None:
+            return await self.fetch(path), content_type
+
+        filename = self._filename(path, width)
+        thumbnail = self._read(filename)
+        if thumbnail is None:
+            original = await self.fetch(path)
+            loop = asyncio.get_running_loop()
+            thumbnail = await loop.run_in_executor(
+                None, self._thumbnail, filename, original, width
+            )
+        return thumbnail, "image/jpeg"
+
+    def has(self, path: str) -> bool:
+        return self._filename(path) in self.entries
+
+    def allow(self, paths):
+        """Replace the set of paths that may be downloaded and served."""
+        self.allowed = frozenset(paths)
+
+    def allows(self, path: str) -> bool:
+        return path in self.allowed or self.has(path)
+
+    async def _prefetch(self, paths: list[str]):
+        fetched = 0
+        for path in paths:
+            if self.has(path):
+                continue
+            try:
+                await self.fetch(path)
+                fetched += 1
+            except Exception as e:
+                print(f"Failed to prefetch image {path}: {e}")
+        if fetched:
+            print(f"Prefetched {fetched} product images.")
+
+    def prefetch(self, paths: list[str]):
+        """Download missing images in the background, one at a time."""
+        if self._prefetch_task and not self._prefetch_task.done():
+            self._prefetch_task.cancel()
+        self._prefetch_task = asyncio.create_task(self._prefetch(paths))
+
+
+IMAGE_CACHE = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+
+
+def local_image_url(url: str) -> str:
+    """Rewrite an OFN image URL to the local image endpoint."""
+    if not url or not url.startswith(INSTANCE_URL):
+        return url
+    path = url[len(INSTANCE_URL) :]
+    if not path.startswith("/") or path == "/":
+        return url
+    return IMAGE_BASE_URL + path
+
+
+def image_path(url: str) -> str | None:
+    """Return the OFN path behind a local image URL, if it is one."""
+    if url and url.startswith(IMAGE_BASE_URL + "/"):
+        return url[len(IMAGE_BASE_URL) :]
+    return None
+
+
+def prefetch_catalog_images(urls):
+    """Prefetch the images behind the given local image URLs."""
+    paths = [path for path in map(image_path, urls) if path]
+    IMAGE_CACHE.allow(paths)
+    IMAGE_CACHE.prefetch(paths)
+
+
+async def serve_image(request_path: str) -> tuple[int, bytes, str]:
+    """Answer a GET on the image route with (status, body, content type)."""
+    parts = urlsplit(request_path)
+    path = parts.path[len(IMAGE_ROUTE) - 1 :]
+    width = None
+    for param in parts.query.split("&"):
+        if param.startswith("w=") and param[2:].isdigit():
+            width = int(param[2:])
+    # Anything outside the catalog would make this an open proxy
+    if not IMAGE_CACHE.allows(path):
+        return 404, b"Not found", "text/plain"
+
+    try:
+        content, content_type = await IMAGE_CACHE.load(path, width)
+    except httpx.HTTPStatusError as e:
+        # Only a missing image is passed on, anything else is a bad gateway
+        if e.response.status_code == 404:
+            return 404, b"Not found", "text/plain"
+        print(f"Failed to serve image {path}: {e.response.status_code}")
+        return 502, b"Upstream error", "text/plain"
+    except Exception as e:
+        print(f"Failed to serve image {path}: {e}")
+        return 502, b"Upstream error", "text/plain"
+    return 200, content, content_type
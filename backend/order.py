@@ -1,9 +1,14 @@
+import asyncio
+import os
+
 import httpx
-from bs4 import BeautifulSoup
 import re
 
-from api import IQToolAPI
-from cart import get_cart_for_session
+from outbox import OUTBOX
+from reference_data import REFERENCE_DATA
+from session_backend import SESSION_BACKEND
+from tracing import TRACER
+from transport import get_client, session_client
 
 
 INSTANCE_URL = "https://openfoodnetwork.de"
@@ -12,29 +17,54 @@ LOGIN_URL = f"{INSTANCE_URL}/user/spree_user/sign_in"
 API_ORDER_URL = f"{INSTANCE_URL}/api/v0/orders"
 ORDER_URL = f"{INSTANCE_URL}/admin/orders/"
 NEW_ORDER_URL = f"{ORDER_URL}/new"
+LINE_ITEM_CONCURRENCY = int(os.environ.get("LINE_ITEM_CONCURRENCY", 6))
+CHECKOUT_STAGE_TIMEOUT = float(os.environ.get("CHECKOUT_STAGE_TIMEOUT", 30))
+
+
+CSRF_TAG = re.compile(r"<(?:meta|input)\b[^>]*>", re.IGNORECASE)
+TAG_ATTRIBUTE = re.compile(r"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+CSRF_FIELDS = {
+    "meta": ("csrf-token", "content"),
+    "input": ("authenticity_token", "value"),
+}
+
+
+def extract_csrf_token(html: str) -> str | None:
+    """Return the first csrf-token meta or authenticity_token input value.
+
+    Scans only <meta> and <input> tags and stops at the first match, which
+    is in the page head, instead of parsing the whole document.
+    """
+    for tag in CSRF_TAG.finditer(html):
+        text = tag.group(0)
+        kind = "meta" if text[1:5].lower() == "meta" else "input"
+        name, field = CSRF_FIELDS[kind]
+        attributes = {
+            key.lower(): double or single
+            for key, double, single in TAG_ATTRIBUTE.findall(text)
+        }
+        if attributes.get("name") == name and attributes.get(field):
+            return attributes[field]
+    return None
 
 
-def fetch_authenticity_token(http_client: httpx.Client) -> str:
+async def fetch_authenticity_token(http_client: httpx.AsyncClient) -> str:
     """Fetch the CSRF token from the given page URL."""
-    resp = http_client.get(PRE_LOGIN_URL)
-    soup = BeautifulSoup(resp.text, "html.parser")
-    token = soup.find("meta", {"name": "csrf-token"})
+    with TRACER.span("ofn.csrf") as span:
+        resp = await http_client.get(PRE_LOGIN_URL)
+        span.status = resp.status_code
+    token = extract_csrf_token(resp.text)
     if token:
-        return token["content"]
-    else:
-        token = soup.find("input", {"name": "authenticity_token"})["value"]
-        if token:
-            return token
-        else:
-            raise Exception("CSRF token not found on the page.")
+        return token
+    raise Exception("CSRF token not found on the page.")
 
 
-def get_session_tokens(
-    http_client: httpx.Client, ofn_admin_email: str, ofn_admin_password: str
+async def get_session_tokens(
+    http_client: httpx.AsyncClient, ofn_admin_email: str, ofn_admin_password: str
 ) -> dict:
     """Login and return session cookies (_ofn_session_id, XSRF-TOKEN)."""
     # 1. GET the new order page to get the CSRF token
-    authenticity_token = fetch_authenticity_token(http_client)
+    authenticity_token = await fetch_authenticity_token(http_client)
 
     # 2. POST login credentials
     payload = {
@@ -42,7 +72,11 @@ def get_session_tokens(
         "spree_user[email]": ofn_admin_email,
         "spree_user[password]": ofn_admin_password,
     }
-    http_client.post(LOGIN_URL, data=payload, headers={"Referer": LOGIN_URL})
+    with TRACER.span("ofn.login") as span:
+        resp = await http_client.post(
+            LOGIN_URL, data=payload, headers={"Referer": LOGIN_URL}
+        )
+        span.status = resp.status_code
 
     # 3. Extract cookies
     cookies = http_client.cookies
@@ -58,13 +92,134 @@ def get_session_tokens(
     }
 
 
-def create_order(
-    http_client: httpx.Client, distributor_id: str, order_cycle_id: str
+class SessionExpired(Exception):
+    """The OFN admin session was rejected and needs a new login."""
+
+
+class TokenRejected(Exception):
+    """OFN refused the cached CSRF token."""
+
+
+def redirected_to_login(response: httpx.Response) -> bool:
+    """Whether OFN sent an admin request to its login page.
+
+    Unauthenticated admin requests end up on the root page, which opens the
+    /#/login modal, with an ?after_login= parameter.
+    """
+    if "/sign_in" in response.url.path or "after_login" in response.url.params:
+        return True
+    if not response.history:
+        return False
+    requested = response.history[0].request.url.path
+    return requested.startswith("/admin") and response.url.path == "/"
+
+
+def check_session(response: httpx.Response):
+    """Raise SessionExpired or TokenRejected if OFN refused the request."""
+    if response.status_code == 401 or redirected_to_login(response):
+        raise SessionExpired()
+    if response.status_code == 422:
+        raise TokenRejected()
+
+
+class OFNAdminSession:
+    """One logged-in OFN admin cookie jar shared by every checkout.
+
+    The login happens on first use. Operations that find the session expired
+    raise SessionExpired and are retried once after a fresh login; concurrent
+    checkouts wait for a single in-flight login instead of starting their own.
+    The CSRF token for admin forms is fetched once per login and reused until
+    OFN rejects it.
+    """
+
+    def __init__(self, email: str, password: str):
+        self.email = email
+        self.password = password
+        self.client = None
+        self.csrf_token = None
+        self.generation = 0
+        self._lock = asyncio.Lock()
+
+    async def login(self, expired: int | None = None) -> int:
+        """Log in if there is no session yet or `expired` is still current."""
+        if self.client is not None and self.generation != expired:
+            return self.generation
+        async with self._lock:
+            # Another caller may have logged in while we waited
+            if self.client is not None and self.generation != expired:
+                return self.generation
+            client = session_client(follow_redirects=True)
+            try:
+                await get_session_tokens(client, self.email, self.password)
+            except Exception:
+                await client.aclose()
+                raise
+            # The old client is not closed, other operations may still be using
+            # it. Its connections belong to the shared pool anyway.
+            self.client = client
+            self.csrf_token = None
+            self.generation += 1
+            print("Logged in to OFN admin.")
+            return self.generation
+
+    async def warm(self):
+        """Log in ahead of the first checkout."""
+        try:
+            await self.login()
+        except Exception as e:
+            print(f"OFN admin login failed: {e}")
+
+    async def authenticity_token(self) -> str:
+        """Return the cached CSRF token, fetching it if there is none."""
+        if self.csrf_token is None:
+            self.csrf_token = await fetch_authenticity_token(self.client)
+        return self.csrf_token
+
+    async def run(self, operation, *args):
+        """Await `operation(http_client, *args)` with a logged-in client."""
+        generation = await self.login()
+        try:
+            return await operation(self.client, *args)
+        except SessionExpired:
+            print("OFN admin session expired, logging in again.")
+            await self.login(expired=generation)
+        except TokenRejected:
+            print("OFN rejected the CSRF token, fetching a new one.")
+            self.csrf_token = None
+        return await operation(self.client, *args)
+
+    async def run_form(self, operation, *args):
+        """Like run(), passing the CSRF token as the second argument."""
+
+        async def with_token(http_client, *args):
+            token = await self.authenticity_token()
+            return await operation(http_client, token, *args)
+
+        return await self.run(with_token, *args)
+
+
+_admin_session = None
+
+
+def get_admin_session(email: str, password: str) -> OFNAdminSession:
+    """Return the process-wide admin session for these credentials."""
+    global _admin_session
+    if (
+        _admin_session is None
+        or _admin_session.email != email
+        or _admin_session.password != password
+    ):
+        _admin_session = OFNAdminSession(email, password)
+    return _admin_session
+
+
+async def create_order(
+    http_client: httpx.AsyncClient,
+    authenticity_token: str,
+    distributor_id: str,
+    order_cycle_id: str,
 ) -> str:
     """Create an order and return the order number if successful."""
-    # 1. GET the new order page to get the CSRF token
-    authenticity_token = fetch_authenticity_token(http_client)
-
     # 1. Prepare your payload (add all required fields!)
     payload = {
         "authenticity_token": authenticity_token,
@@ -73,9 +228,12 @@ def create_order(
     }
 
     # 2. POST to create the order
-    response = http_client.post(
-        ORDER_URL, data=payload, headers={"Referer": NEW_ORDER_URL}
-    )
+    with TRACER.span("ofn.create_order") as span:
+        response = await http_client.post(
+            ORDER_URL, data=payload, headers={"Referer": NEW_ORDER_URL}
+        )
+        span.status = response.status_code
+    check_session(response)
     match = re.search(r"Order\s*#\s*([A-Z0-9]+)", response.text)
     if match:
         order_id = match.group(1)
@@ -84,151 +242,233 @@ def create_order(
         raise Exception("Order number not found in response.")
 
 
-def get_order_data(ofn_api_key: str, order_id: str):
+async def cancel_order(
+    http_client: httpx.AsyncClient, authenticity_token: str, order_id: str
+):
+    """Fire the cancel event of a completed order.
+
+    OFN redirects whether or not the event was accepted, so the new state
+    has to be read back through the API.
+    """
+    payload = {
+        "_method": "put",
+        "authenticity_token": authenticity_token,
+        "e": "cancel",
+    }
+    with TRACER.span("ofn.cancel_order") as span:
+        response = await http_client.post(f"{ORDER_URL}{order_id}/fire", data=payload)
+        span.status = response.status_code
+    check_session(response)
+    if response.status_code >= 400:
+        raise Exception(f"Cancelling order {order_id} failed: {response.status_code}")
+
+
+async def fetch_order(ofn_api_key: str, order_id: str) -> dict:
+    """Return the order as the OFN API shows it."""
+    url = f"{API_ORDER_URL}/{order_id}.json"
+    headers = {"Accept": "application/json", "X-Spree-Token": ofn_api_key}
+    with TRACER.span("ofn.order") as span:
+        response = await get_client().get(url, headers=headers)
+        span.status = response.status_code
+    response.raise_for_status()
+    return response.json()
+
+
+async def empty_order(ofn_api_key: str, order_id: str, order: dict):
+    """Remove every line item of an order that was never completed."""
+    shipments = order.get("shipments") or []
+    if not shipments:
+        return
+    shipment = shipments[0]["number"]
+    url = f"{API_ORDER_URL}/{order_id}/shipments/{shipment}/remove.json"
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "X-Spree-Token": ofn_api_key,
+    }
+    for item in order.get("line_items") or []:
+        variant_id = item.get("variant_id") or (item.get("variant") or {}).get("id")
+        payload = {"variant_id": variant_id, "quantity": item["quantity"]}
+        with TRACER.span("ofn.remove_line_item", variant_id=variant_id) as span:
+            response = await get_client().put(url, headers=headers, json=payload)
+            span.status = response.status_code
+        response.raise_for_status()
+
+
+class OrderNotDisposed(Exception):
+    """OFN still shows an order that should be cancelled or empty."""
+
+
+async def dispose_order(admin: OFNAdminSession, ofn_api_key: str, order_id: str):
+    """Get rid of an order nobody is going to check out.
+
+    Spree only cancels completed orders, so incomplete ones, which every
+    draft is, are emptied instead: an empty cart-state order is never paid
+    or delivered. Either way the result is confirmed through the API and
+    OrderNotDisposed is raised if OFN did not apply it.
+    """
+    order = await fetch_order(ofn_api_key, order_id)
+    if order.get("state") == "canceled":
+        return
+    if order.get("completed_at"):
+        await admin.run_form(cancel_order, order_id)
+        order = await fetch_order(ofn_api_key, order_id)
+        if order.get("state") != "canceled":
+            raise OrderNotDisposed(f"Order {order_id} is {order.get('state')}.")
+    else:
+        await empty_order(ofn_api_key, order_id, order)
+        order = await fetch_order(ofn_api_key, order_id)
+        if order.get("line_items"):
+            raise OrderNotDisposed(f"Order {order_id} still has line items.")
+
+
+async def get_order_data(ofn_api_key: str, order_id: str):
     """Fetch order details via OFN API."""
     url = f"{API_ORDER_URL}/{order_id}?token={ofn_api_key}"
     headers = {"Accept": "application/json", "Content-Type": "application/json"}
-    response = httpx.get(url, headers=headers)
+    response = await get_client().get(url, headers=headers)
     print("Status code:", response.status_code)
     print("Response JSON:", response.json())
 
 
-def update_customer(
-    session_tokens: dict,
+async def update_customer(
+    http_client: httpx.AsyncClient,
+    authenticity_token: str,
     order_id: str,
     customer_data: dict,
 ):
     """Update customer information for the given order."""
-    with httpx.Client(follow_redirects=True, cookies=session_tokens) as http_client:
-        # 1. GET the new order page to get the CSRF token
-        authenticity_token = fetch_authenticity_token(http_client)
-
-        # 2. Prepare the URL for updating customer information
-        url = f"{INSTANCE_URL}/admin/orders/{order_id}/customer"
-
-        # 3. Prepare your payload (add all required fields!)
-        bill_address = customer_data.get("bill_address", {})
-        ship_address = customer_data.get("ship_address") or bill_address
-
-        # --- You must map codes to OFN IDs here ---
-        # For production, fetch these from OFN API or config!
-        COUNTRY_CODE_TO_ID = {"DE": "155"}  # Example: Germany
-        STATE_CODE_TO_ID = {
-            "BW": "54",  # Baden-Württemberg
-            "BY": "55",  # Bayern
-            "BE": "53",  # Berlin
-            "BB": "52",  # Brandenburg
-            "HB": "56",  # Bremen
-            "HH": "58",  # Hamburg
-            "HE": "57",  # Hessen
-            "MV": "59",  # Mecklenburg-Vorpommern
-            "NI": "60",  # Niedersachsen
-            "NW": "61",  # Nordrhein-Westfalen
-            "RP": "62",  # Rheinland-Pfalz
-            "SL": "64",  # Saarland
-            "SN": "65",  # Sachsen
-            "ST": "66",  # Sachsen-Anhalt
-            "SH": "63",  # Schleswig-Holstein
-            "TH": "67",  # Thüringen
-        }
+    # 1. Prepare the URL for updating customer information
+    url = f"{INSTANCE_URL}/admin/orders/{order_id}/customer"
+
+    # 2. Prepare your payload (add all required fields!)
+    bill_address = customer_data.get("bill_address", {})
+    ship_address = customer_data.get("ship_address") or bill_address
+
+    payload = {
+        "_method": "patch",
+        "authenticity_token": authenticity_token,
+        "order[email]": customer_data.get("email", ""),
+        "order[bill_address_attributes][firstname]": bill_address.get("first_name", ""),
+        "order[bill_address_attributes][lastname]": bill_address.get("last_name", ""),
+        "order[bill_address_attributes][address1]": bill_address.get(
+            "street_address_1", ""
+        ),
+        "order[bill_address_attributes][address2]": bill_address.get("street_address_2")
+        or "",
+        "order[bill_address_attributes][city]": bill_address.get("locality", ""),
+        "order[bill_address_attributes][zipcode]": bill_address.get("postal_code", ""),
+        "order[bill_address_attributes][country_id]": REFERENCE_DATA.country_id(
+            bill_address.get("country")
+        ),
+        "order[bill_address_attributes][state_id]": REFERENCE_DATA.state_id(
+            bill_address.get("country"), bill_address.get("region")
+        ),
+        "order[bill_address_attributes][phone]": bill_address.get("phone", ""),
+        "order[use_billing]": "1",
+        "order[ship_address_attributes][firstname]": ship_address.get("first_name", ""),
+        "order[ship_address_attributes][lastname]": ship_address.get("last_name", ""),
+        "order[ship_address_attributes][address1]": ship_address.get(
+            "street_address_1", ""
+        ),
+        "order[ship_address_attributes][address2]": ship_address.get("street_address_2")
+        or "",
+        "order[ship_address_attributes][city]": ship_address.get("locality", ""),
+        "order[ship_address_attributes][zipcode]": ship_address.get("postal_code", ""),
+        "order[ship_address_attributes][country_id]": REFERENCE_DATA.country_id(
+            ship_address.get("country")
+        ),
+        "order[ship_address_attributes][state_id]": REFERENCE_DATA.state_id(
+            ship_address.get("country"), ship_address.get("region")
+        ),
+        "order[ship_address_attributes][phone]": ship_address.get("phone", ""),
+        "order[customer_id]": customer_data.get("id", ""),
+        "button": "",
+    }
 
-        def get_country_id(country):
-            if country and "code" in country:
-                return COUNTRY_CODE_TO_ID.get(country["code"], "")
-            return ""
+    # 3. POST to update customer information
+    with TRACER.span("ofn.update_customer") as span:
+        resp = await http_client.put(url, data=payload)
+        span.status = resp.status_code
+    check_session(resp)
 
-        def get_state_id(region):
-            if region and "code" in region:
-                return STATE_CODE_TO_ID.get(region["code"], "")
-            return ""
 
-        payload = {
-            "_method": "patch",
-            "authenticity_token": authenticity_token,
-            "order[email]": customer_data.get("email", ""),
-            "order[bill_address_attributes][firstname]": bill_address.get(
-                "first_name", ""
-            ),
-            "order[bill_address_attributes][lastname]": bill_address.get(
-                "last_name", ""
-            ),
-            "order[bill_address_attributes][address1]": bill_address.get(
-                "street_address_1", ""
-            ),
-            "order[bill_address_attributes][address2]": bill_address.get(
-                "street_address_2"
-            )
-            or "",
-            "order[bill_address_attributes][city]": bill_address.get("locality", ""),
-            "order[bill_address_attributes][zipcode]": bill_address.get(
-                "postal_code", ""
-            ),
-            "order[bill_address_attributes][country_id]": get_country_id(
-                bill_address.get("country")
-            ),
-            "order[bill_address_attributes][state_id]": get_state_id(
-                bill_address.get("region")
-            ),
-            "order[bill_address_attributes][phone]": bill_address.get("phone", ""),
-            "order[use_billing]": "1",
-            "order[ship_address_attributes][firstname]": ship_address.get(
-                "first_name", ""
-            ),
-            "order[ship_address_attributes][lastname]": ship_address.get(
-                "last_name", ""
-            ),
-            "order[ship_address_attributes][address1]": ship_address.get(
-                "street_address_1", ""
-            ),
-            "order[ship_address_attributes][address2]": ship_address.get(
-                "street_address_2"
-            )
-            or "",
-            "order[ship_address_attributes][city]": ship_address.get("locality", ""),
-            "order[ship_address_attributes][zipcode]": ship_address.get(
-                "postal_code", ""
-            ),
-            "order[ship_address_attributes][country_id]": get_country_id(
-                ship_address.get("country")
-            ),
-            "order[ship_address_attributes][state_id]": get_state_id(
-                ship_address.get("region")
-            ),
-            "order[ship_address_attributes][phone]": ship_address.get("phone", ""),
-            "order[customer_id]": customer_data.get("id", ""),
-            "button": "",
-        }
+class LineItemError(Exception):
+    """Some cart items could not be added to the order.
+
+    `failures` holds (item, HTTP status or error class name) pairs. The
+    message never includes exception text, which may carry request URLs.
+    """
 
-        # 4. POST to update customer information
-        resp = http_client.put(url, data=payload)
+    def __init__(self, order_id: str, failures: list):
+        self.order_id = order_id
+        self.failures = failures
+        details = ", ".join(f"{item['id']}: {reason}" for item, reason in failures)
+        super().__init__(
+            f"Failed to add {len(failures)} line items to order {order_id}: {details}"
+        )
 
 
-def add_line_items(
-    http_client: httpx.Client, ofn_api_key: str, order_id: str, cart: list
+def line_item_failure(result) -> str | None:
+    """Why adding a line item failed, None if it succeeded."""
+    if isinstance(result, Exception):
+        return type(result).__name__
+    if result >= 400:
+        return f"HTTP {result}"
+    return None
+
+
+async def add_line_items(
+    http_client: httpx.AsyncClient, ofn_api_key: str, order_id: str, cart: list
 ):
-    """Add line items to the order."""
-    url = f"{INSTANCE_URL}/api/v0/orders/{order_id}/shipments.json?token={ofn_api_key}"
+    """Add line items to the order.
+
+    OFN has no batch endpoint, so items are posted concurrently, at most
+    LINE_ITEM_CONCURRENCY at a time. The first item is posted on its own:
+    OFN creates the order's shipment with it, and concurrent first posts
+    could each create one. Raises LineItemError listing every item that
+    failed once all requests have finished.
+    """
+    url = f"{INSTANCE_URL}/api/v0/orders/{order_id}/shipments.json"
     headers = {
         "Accept": "application/json",
         "Content-Type": "application/json",
+        "X-Spree-Token": ofn_api_key,
     }
+    slots = asyncio.Semaphore(LINE_ITEM_CONCURRENCY)
 
-    for item in cart:
+    async def add(item) -> int:
         payload = {
             "variant_id": item["id"],
             "quantity": item["quantity"],
         }
-        http_client.post(url, headers=headers, json=payload)
-
-
-def mark_payment(
-    session_tokens: dict, order_id: str, payment_method_id: str, amount: str
+        async with slots:
+            with TRACER.span("ofn.line_item", variant_id=item["id"]) as span:
+                response = await http_client.post(url, headers=headers, json=payload)
+                span.status = response.status_code
+        return response.status_code
+
+    first, rest = cart[:1], cart[1:]
+    results = await asyncio.gather(*map(add, first), return_exceptions=True)
+    if line_item_failure(results[0]) is None:
+        results += await asyncio.gather(*map(add, rest), return_exceptions=True)
+    failures = [
+        (item, reason)
+        for item, reason in zip(cart, map(line_item_failure, results))
+        if reason is not None
+    ]
+    if failures:
+        raise LineItemError(order_id, failures)
+
+
+async def mark_payment(
+    http_client: httpx.AsyncClient, order_id: str, payment_method_id: str, amount: str
 ):
     """Create a payment for the order."""
     url = f"{INSTANCE_URL}/admin/orders/{order_id}/payments.json"
     headers = {
         "Referer": f"{INSTANCE_URL}/admin/orders/{order_id}/payments/new",
-        "x-xsrf-token": session_tokens["XSRF-TOKEN"],
+        "x-xsrf-token": http_client.cookies.get("XSRF-TOKEN", ""),
         "User-Agent": "Mozilla/5.0",
     }
     payload = {
@@ -236,18 +476,64 @@ def mark_payment(
         "payment[amount]": amount,
         "order_id": order_id,
     }
-    with httpx.Client(follow_redirects=True, cookies=session_tokens) as http_client:
-        resp = http_client.post(url, headers=headers, data=payload)
+    with TRACER.span("ofn.payment") as span:
+        resp = await http_client.post(url, headers=headers, data=payload)
+        span.status = resp.status_code
+    check_session(resp)
 
 
-def generate_invoice(order_id: str):
-    """Generate an invoice for the order from IQ tool."""
+async def generate_invoice(order_id: str):
+    """Queue invoice generation for the order in IQ tool."""
     payload = {"order_no": order_id}
-    api_service = IQToolAPI()
-    api_service.post("/generate-invoice-pdf-webhook/", payload=payload)
+    OUTBOX.enqueue("invoice", payload)
+
+
+async def run_stage(name: str, awaitable, progress=None):
+    """Await one checkout stage under CHECKOUT_STAGE_TIMEOUT, reporting progress."""
+    if progress:
+        await progress(name, "started")
+    try:
+        with TRACER.span(f"checkout.{name}"):
+            result = await asyncio.wait_for(awaitable, CHECKOUT_STAGE_TIMEOUT)
+    except Exception:
+        if progress:
+            await progress(name, "failed")
+        raise
+    if progress:
+        await progress(name, "done")
+    return result
+
+
+async def prepare_order(
+    ofn_admin_email: str,
+    ofn_admin_password: str,
+    distributor_id: str,
+    order_cycle_id: str,
+    customer_data: dict,
+    order_id: str | None = None,
+    created=None,
+) -> str:
+    """Create an order, or reuse `order_id`, and fill in the customer.
+
+    `created(order_id)` is called as soon as a new order exists, before the
+    customer is filled in.
+    """
+    admin = get_admin_session(ofn_admin_email, ofn_admin_password)
+    if order_id is None:
+        order_id = await asyncio.wait_for(
+            admin.run_form(create_order, distributor_id, order_cycle_id),
+            CHECKOUT_STAGE_TIMEOUT,
+        )
+        if created:
+            created(order_id)
+    await asyncio.wait_for(
+        admin.run_form(update_customer, order_id, customer_data),
+        CHECKOUT_STAGE_TIMEOUT,
+    )
+    return order_id
 
 
-def create_ofn_order_from_session(
+async def create_ofn_order_from_session(
     session_id: str,
     ofn_api_key: str,
     ofn_admin_email: str,
@@ -256,35 +542,66 @@ def create_ofn_order_from_session(
     order_cycle_id: str,
     payment_method_id: str,
     customer_data: dict,
+    progress=None,
+    order_id: str | None = None,
 ) -> dict:
+    """Create, fill and pay the OFN order for a session's cart.
+
+    `progress(stage, status)` is awaited as each stage starts, finishes or
+    fails. Every stage is bounded by CHECKOUT_STAGE_TIMEOUT. An `order_id`
+    prepared ahead of time with prepare_order skips the create and customer
+    stages.
+    """
     # 1. Get the cart for this session
-    cart = get_cart_for_session(session_id)
+    session_cart = await SESSION_BACKEND.get_cart(session_id, fresh=True)
+    cart = session_cart.items()
     if not cart:
         raise Exception("Cart is empty.")
+    total = session_cart.total
 
-    with httpx.Client(follow_redirects=True) as http_client:
-        # 2. Get session tokens (login)
-        session_tokens = get_session_tokens(
-            http_client, ofn_admin_email, ofn_admin_password
-        )
+    # 2. Reuse the logged-in admin session
+    admin = get_admin_session(ofn_admin_email, ofn_admin_password)
+    await run_stage("login", admin.login(), progress)
 
+    if order_id is None:
         # 3. Create the order
-        order_id = create_order(http_client, distributor_id, order_cycle_id)
+        order_id = await run_stage(
+            "create",
+            admin.run_form(create_order, distributor_id, order_cycle_id),
+            progress,
+        )
 
         # 4. Update customer info
-        update_customer(session_tokens, order_id, customer_data)
+        await run_stage(
+            "customer",
+            admin.run_form(update_customer, order_id, customer_data),
+            progress,
+        )
+    elif progress:
+        await progress("create", "prepared")
+        await progress("customer", "prepared")
+
+    # 5. Add line items
+    await run_stage(
+        "line_items",
+        add_line_items(get_client(), ofn_api_key, order_id, cart),
+        progress,
+    )
 
-        # 5. Add line items
-        add_line_items(http_client, ofn_api_key, order_id, cart)
+    # 6. Create payment
+    await run_stage(
+        "payment",
+        admin.run(mark_payment, order_id, payment_method_id, str(total)),
+        progress,
+    )
 
-        # 6. Create payment
-        total = sum(item["price"] * item.get("quantity", 1) for item in cart)
-        mark_payment(session_tokens, order_id, payment_method_id, str(total))
+    # 7. Queue the invoice, IQ Tool receives it through the outbox
+    await run_stage("invoice", generate_invoice(order_id), progress)
 
     # Return order id, cart
     return {
         "customer": customer_data,
         "order_id": order_id,
         "cart": cart,
-        "total": total,
+        "total": float(total),
     }
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+import time
+
+from api import get_api_service
+from storage import connect
+
+
+OUTBOX_DB = "outbox.sqlite3"
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_BASE_BACKOFF = float(os.environ.get("OUTBOX_BASE_BACKOFF", 2))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", 600))
+OUTBOX_IDLE_POLL = 30
+
+
+class Outbox:
+    """SQLite-backed queue of outgoing webhook events.
+
+    enqueue() only writes a row, so callers never wait on the network. The
+    run() task delivers due events in batches through the handler registered
+    for their kind, deleting them on success and rescheduling them with
+    exponential backoff on failure. Events survive restarts.
+    """
+
+    def __init__(self, filename: str, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.handlers = {}
+        self._conn = None
+        self._wakeup = asyncio.Event()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = connect(self.filename)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    next_attempt_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )
+                """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)"
+            )
+        return self._conn
+
+    def register(self, kind: str, handler):
+        """Deliver events of `kind` with the coroutine function `handler(payload)`."""
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind: str, payload: dict) -> int:
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (kind, payload, created_at, next_attempt_at)"
+                " VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), now, now),
+            )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def _due(self) -> list:
+        return self.conn.execute(
+            "SELECT id, kind, payload, attempts FROM outbox"
+            " WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (time.time(), self.batch_size),
+        ).fetchall()
+
+    def _next_due_in(self) -> float:
+        row = self.conn.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+        if row[0] is None:
+            return OUTBOX_IDLE_POLL
+        return min(max(row[0] - time.time(), 0.0), OUTBOX_IDLE_POLL)
+
+    async def _deliver(self, kind: str, payload: str):
+        handler = self.handlers.get(kind)
+        if handler is None:
+            raise Exception(f"No outbox handler for {kind!r}.")
+        await handler(json.loads(payload))
+
+    async def drain_once(self) -> int:
+        """Deliver one batch of due events, return how many were attempted."""
+        rows = self._due()
+        if not rows:
+            return 0
+        results = await asyncio.gather(
+            *(self._deliver(kind, payload) for _, kind, payload, _ in rows),
+            return_exceptions=True,
+        )
+        now = time.time()
+        delivered = []
+        failed = []
+        for (event_id, kind, _, attempts), result in zip(rows, results):
+            if isinstance(result, Exception):
+                backoff = min(OUTBOX_BASE_BACKOFF * 2**attempts, OUTBOX_MAX_BACKOFF)
+                failed.append((now + backoff, str(result)[:500], event_id))
+                print(f"Outbox {kind} event {event_id} failed, retry in {backoff}s.")
+            else:
+                delivered.append((event_id,))
+        with self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", delivered)
+            self.conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ?, attempts = attempts + 1,"
+                " last_error = ? WHERE id = ?",
+                failed,
+            )
+        return len(rows)
+
+    async def run(self):
+        """Background worker draining the outbox, runs forever."""
+        while True:
+            try:
+                if await self.drain_once():
+                    continue
+                timeout = self._next_due_in()
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                timeout = OUTBOX_BASE_BACKOFF
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        """Queue depth, age of the oldest event and retry counts."""
+        depth, oldest, retrying, max_attempts = self.conn.execute(
+            "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0), MAX(attempts)"
+            " FROM outbox"
+        ).fetchone()
+        by_kind = dict(
+            self.conn.execute("SELECT kind, COUNT(*) FROM outbox GROUP BY kind")
+        )
+        return {
+            "depth": depth,
+            "oldest_age": round(time.time() - oldest, 1) if oldest else 0.0,
+            "retrying": retrying or 0,
+            "max_attempts": max_attempts or 0,
+            "by_kind": by_kind,
+        }
+
+
+def iqtool_post(endpoint: str):
+    """Outbox handler that POSTs the event payload to an IQ Tool endpoint."""
+
+    async def handler(payload: dict):
+        await get_api_service().post(endpoint, payload)
+
+    return handler
+
+
+OUTBOX = Outbox(OUTBOX_DB)
+OUTBOX.register("entrance_history", iqtool_post("entrance-history/create/"))
+OUTBOX.register("invoice", iqtool_post("/generate-invoice-pdf-webhook/"))
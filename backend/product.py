@@ -1,86 +1,331 @@
-import httpx
+import asyncio
+import gzip
+import os
+
+from dataclasses import dataclass
+
+from catalog_cache import CatalogCache
+from catalog_snapshot import load_snapshot, save_snapshot
+from catalog_sync import CatalogSync, diff_catalog
+from codec import encode
+from image_cache import local_image_url, prefetch_catalog_images
+from search import ProductSearch
+from transport import get_client
 
 
 INSTANCE_URL = "https://openfoodnetwork.de"
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 300))
 
 
-def load_products(ofn_api_key: str, ofn_shop_id: str) -> dict:
-    """Load products from Open Food Network API."""
-    headers = {
-        "Accept": "application/json;charset=UTF-8",
-        "Content-Type": "application/json",
-        "X-Spree-Token": ofn_api_key,
+def empty_catalog() -> dict:
+    return {
+        "product_array": {},
+        "product_weight_array": {},
+        "taxes_array": {},
     }
+
+
+def catalog_urls(ofn_shop_id: str) -> tuple[str, str]:
     products_url = (
         f"{INSTANCE_URL}/api/v0/products/bulk_products?q[supplier_id_in]={ofn_shop_id}"
     )
     tax_url = f"{INSTANCE_URL}/api/v0/taxons"
-    try:
-        with httpx.Client() as client:
-            # Fetch products
-            products_resp = client.get(products_url, headers=headers)
-            products_resp.raise_for_status()
-            products_obj = products_resp.json()
-
-            # Fetch taxons (categories)
-            tax_resp = client.get(tax_url, headers=headers)
-            tax_resp.raise_for_status()
-            tax_obj = tax_resp.json()
-
-        # Build category (taxon) lookup: id -> name
-        category_lookup = {t["id"]: t["name"] for t in tax_obj}
-
-        product_array = {}
-        product_weight_array = {}
-        for product in products_obj.get("products", []):
-            for variant in product.get("variants", []):
-                category_id = variant.get("category_id")
-                p = {
-                    "id": variant["id"],
-                    "sku": variant.get("sku"),
-                    "name": variant.get("name_to_display"),
-                    "image": (
-                        variant.get("image")
-                        if "openfoodnetwork.de" in variant.get("image", "")
-                        else f"https://openfoodnetwork.de{variant.get('image', '')}"
-                    ),
-                    "price": variant.get("price"),
-                    "unit_value": float(variant.get("unit_value", 1)),
-                    "unit": variant.get("unit_to_display")
-                    or variant.get("options_text")
-                    or "",
-                    "category_id": category_id,
-                    "category_name": category_lookup.get(category_id, ""),
-                }
-                if variant.get("variant_unit") == "weight":
-                    product_weight_array[variant["id"]] = p
-                else:
-                    p["sku"] = variant.get("sku")
-                    product_array[variant["id"]] = p
-
-        # Build taxonomies/categories array for used categories
-        ava = {}
-        for o in list(product_weight_array.values()) + list(product_array.values()):
-            category_id = o["category_id"]
-            if (
-                category_id
-                and category_id not in ava
-                and category_id in category_lookup
-            ):
-                ava[category_id] = {
-                    "id": category_id,
-                    "name": category_lookup[category_id],
-                }
+    return products_url, tax_url
 
+
+def catalog_headers(ofn_api_key: str) -> dict:
+    return {
+        "Accept": "application/json;charset=UTF-8",
+        "Content-Type": "application/json",
+        "X-Spree-Token": ofn_api_key,
+    }
+
+
+@dataclass(slots=True)
+class Variant:
+    """Compact catalog record for a single OFN variant."""
+
+    id: int
+    sku: str | None
+    name: str | None
+    image: str
+    price: str | None
+    unit_value: float
+    unit: str
+    category_id: int | None
+    category_name: str
+
+    def to_dict(self) -> dict:
         return {
-            "product_array": product_array,
-            "product_weight_array": product_weight_array,
-            "taxes_array": ava,
+            "id": self.id,
+            "sku": self.sku,
+            "name": self.name,
+            "image": self.image,
+            "price": self.price,
+            "unit_value": self.unit_value,
+            "unit": self.unit,
+            "category_id": self.category_id,
+            "category_name": self.category_name,
+        }
+
+
+PRODUCT_SECTIONS = ("product_array", "product_weight_array")
+
+
+def catalog_as_dict(data: dict) -> dict:
+    """Return built catalog data with variants as plain dicts."""
+    plain = dict(data)
+    for section in PRODUCT_SECTIONS:
+        plain[section] = {
+            key: variant.to_dict() for key, variant in data.get(section, {}).items()
+        }
+    return plain
+
+
+def catalog_from_dict(plain: dict) -> dict:
+    """Inverse of catalog_as_dict."""
+    data = dict(plain)
+    for section in PRODUCT_SECTIONS:
+        data[section] = {
+            key: Variant(**variant) for key, variant in plain.get(section, {}).items()
         }
+    return data
+
+
+def diff_as_dict(diff: dict) -> dict:
+    plain = {}
+    for section, changes in diff.items():
+        if section in PRODUCT_SECTIONS:
+            changes = {
+                "added": {k: v.to_dict() for k, v in changes["added"].items()},
+                "changed": {k: v.to_dict() for k, v in changes["changed"].items()},
+                "removed": changes["removed"],
+            }
+        plain[section] = changes
+    return plain
+
+
+def build_catalog(products_obj: dict, tax_obj: list) -> dict:
+    """Build the product, weighted product and category arrays."""
+    # Build category (taxon) lookup: id -> name
+    category_lookup = {t["id"]: t["name"] for t in tax_obj}
+
+    product_array = {}
+    product_weight_array = {}
+    for product in products_obj.get("products", []):
+        for variant in product.get("variants", []):
+            category_id = variant.get("category_id")
+            p = Variant(
+                id=variant["id"],
+                sku=variant.get("sku"),
+                name=variant.get("name_to_display"),
+                image=local_image_url(
+                    variant.get("image")
+                    if "openfoodnetwork.de" in variant.get("image", "")
+                    else f"https://openfoodnetwork.de{variant.get('image', '')}"
+                ),
+                price=variant.get("price"),
+                unit_value=float(variant.get("unit_value", 1)),
+                unit=variant.get("unit_to_display")
+                or variant.get("options_text")
+                or "",
+                category_id=category_id,
+                category_name=category_lookup.get(category_id, ""),
+            )
+            if variant.get("variant_unit") == "weight":
+                product_weight_array[variant["id"]] = p
+            else:
+                product_array[variant["id"]] = p
+
+    # Build taxonomies/categories array for used categories
+    ava = {}
+    for o in list(product_weight_array.values()) + list(product_array.values()):
+        category_id = o.category_id
+        if category_id and category_id not in ava and category_id in category_lookup:
+            ava[category_id] = {
+                "id": category_id,
+                "name": category_lookup[category_id],
+            }
+
+    return {
+        "product_array": product_array,
+        "product_weight_array": product_weight_array,
+        "taxes_array": ava,
+    }
+
+
+def normalize_key(value) -> str:
+    """Normalize a SKU or product name for index lookups."""
+    if value is None:
+        return ""
+    return str(value).strip().lower()
+
+
+class ProductIndex:
+    """Normalized SKU -> variant and name -> variant lookups for a catalog."""
+
+    def __init__(self, catalog: dict):
+        self.by_sku = {}
+        self.by_name = {}
+        for variant in catalog.get("product_array", {}).values():
+            sku = normalize_key(variant.sku)
+            if sku:
+                self.by_sku.setdefault(sku, variant)
+        for variant in catalog.get("product_weight_array", {}).values():
+            name = normalize_key(variant.name)
+            if name:
+                self.by_name.setdefault(name, variant)
+
+    def find_by_sku(self, sku: str) -> Variant | None:
+        return self.by_sku.get(normalize_key(sku))
+
+    def find_by_name(self, name: str) -> Variant | None:
+        return self.by_name.get(normalize_key(name))
+
+
+class Catalog:
+    """A built product catalog together with its lookup and search indexes.
+
+    `version` increases every time the catalog content changes and `diff`
+    holds the per-variant changes from the previous version, if known.
+    The websocket payloads are serialized once per version and reused.
+    """
+
+    def __init__(self, data: dict, version: int = 0, diff: dict | None = None):
+        self.data = data
+        self.version = version
+        self.diff = diff
+        self.index = ProductIndex(data)
+        self.search = ProductSearch(data)
+        self._payload = None
+        self._payload_gzip = None
+        self._diff_payload = None
+
+    def as_dict(self) -> dict:
+        return catalog_as_dict(self.data)
+
+    def payload(self) -> bytes:
+        """UTF-8 JSON of the full load_products message."""
+        if self._payload is None:
+            message = {"type": "load_products", "version": self.version}
+            message.update(self.as_dict())
+            self._payload = encode(message)
+        return self._payload
+
+    def payload_gzip(self) -> bytes:
+        if self._payload_gzip is None:
+            self._payload_gzip = gzip.compress(self.payload(), compresslevel=6)
+        return self._payload_gzip
+
+    def diff_payload(self) -> bytes | None:
+        """UTF-8 JSON of the products_diff message from the previous version."""
+        if self.diff is None:
+            return None
+        if self._diff_payload is None:
+            message = {"type": "products_diff", "version": self.version}
+            message.update(diff_as_dict(self.diff))
+            self._diff_payload = encode(message)
+        return self._diff_payload
+
+
+CATALOG_SYNC = CatalogSync()
+
+
+def next_catalog(previous: Catalog | None, products_obj: dict, tax_obj: list):
+    """Build the catalog that follows `previous`, or return `previous` if equal."""
+    data = build_catalog(products_obj, tax_obj)
+    if previous is None:
+        catalog = Catalog(data, version=1)
+    else:
+        diff = diff_catalog(previous.data, data)
+        if diff is None:
+            return previous
+        print(f"Catalog changed, now at version {previous.version + 1}.")
+        catalog = Catalog(data, version=previous.version + 1, diff=diff)
+
+    try:
+        save_snapshot(catalog.as_dict(), catalog.version)
+    except Exception as e:
+        print(f"Failed to save catalog snapshot: {e}")
+    return catalog
+
+
+async def load_catalog(ofn_api_key: str, ofn_shop_id: str) -> Catalog:
+    """Sync the catalog from OFN and build its indexes, raising on failure.
+
+    Unchanged upstream payloads reuse the current catalog without a rebuild.
+    """
+    previous = CATALOG_CACHE.data
+    if previous is None:
+        CATALOG_SYNC.reset()
+
+    headers = catalog_headers(ofn_api_key)
+    products_url, tax_url = catalog_urls(ofn_shop_id)
+    client = get_client()
+    results = await asyncio.gather(
+        CATALOG_SYNC.get_json(client, products_url, headers),
+        CATALOG_SYNC.get_json(client, tax_url, headers),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            # Keep the old validators so the next sync sees the change again
+            CATALOG_SYNC.discard()
+            raise result
+    (products_changed, products_obj), (tax_changed, tax_obj) = results
+
+    if previous is not None and not products_changed and not tax_changed:
+        CATALOG_SYNC.commit()
+        return previous
+
+    # Building, indexing and snapshotting is CPU and disk work, keep it off the loop
+    loop = asyncio.get_running_loop()
+    try:
+        catalog = await loop.run_in_executor(
+            None, next_catalog, previous, products_obj, tax_obj
+        )
+    except BaseException:
+        CATALOG_SYNC.discard()
+        raise
+    CATALOG_SYNC.commit()
+    return catalog
+
+
+CATALOG_CACHE = CatalogCache(
+    load_catalog,
+    ttl=CATALOG_CACHE_TTL,
+    on_change=lambda catalog: prefetch_catalog_images(
+        variant.image
+        for section in PRODUCT_SECTIONS
+        for variant in catalog.data[section].values()
+    ),
+)
+
+
+async def get_catalog(ofn_api_key: str, ofn_shop_id: str) -> Catalog:
+    """Return the cached catalog and its indexes."""
+    try:
+        return await CATALOG_CACHE.get(ofn_api_key, ofn_shop_id)
     except Exception as e:
         print(f"Error loading products: {e}")
-        return {
-            "product_array": {},
-            "product_weight_array": {},
-            "taxes_array": {},
-        }
+        return Catalog(empty_catalog())
+
+
+def restore_catalog_snapshot() -> bool:
+    """Serve the last saved catalog until the first refresh from OFN."""
+    try:
+        snapshot = load_snapshot()
+    except Exception as e:
+        print(f"Failed to load catalog snapshot: {e}")
+        return False
+    if snapshot is None:
+        return False
+    data, version = snapshot
+    CATALOG_CACHE.prime(Catalog(catalog_from_dict(data), version=version))
+    print(f"Restored catalog snapshot version {version}.")
+    return True
+
+
+def invalidate_products():
+    """Force the next catalog read to revalidate against OFN."""
+    CATALOG_CACHE.invalidate()
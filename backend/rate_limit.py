@@ -0,0 +1,47 @@
+import time
+
+
+class ExpiringSet:
+    """Set of keys that are forgotten `ttl` seconds after being added."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.expires = {}
+
+    def add(self, key):
+        self._prune()
+        self.expires[key] = time.monotonic() + self.ttl
+
+    def discard(self, key):
+        self.expires.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        expires_at = self.expires.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self.expires[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        self._prune()
+        return len(self.expires)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, t in self.expires.items() if t <= now]:
+            del self.expires[key]
+
+
+class RateLimiter:
+    """Allow an action for a key at most once every `interval` seconds."""
+
+    def __init__(self, interval: float):
+        self.recent = ExpiringSet(interval)
+
+    def allow(self, key) -> bool:
+        if key in self.recent:
+            return False
+        self.recent.add(key)
+        return True
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import time
+
+from storage import connect
+from transport import get_client
+
+
+INSTANCE_URL = "https://openfoodnetwork.de"
+COUNTRIES_URL = f"{INSTANCE_URL}/api/v0/countries"
+REFERENCE_DB = "reference.sqlite3"
+REFERENCE_REFRESH_INTERVAL = float(
+    os.environ.get("REFERENCE_REFRESH_INTERVAL", 7 * 24 * 3600)
+)
+REFERENCE_RETRY_INTERVAL = 3600
+# Addresses without a country are assumed to be in the shop's country
+DEFAULT_COUNTRY_CODE = "DE"
+
+# Used until the first successful fetch from OFN
+SEED_COUNTRIES = {"DE": "155"}
+SEED_STATES = {
+    ("DE", "BW"): "54",  # Baden-Württemberg
+    ("DE", "BY"): "55",  # Bayern
+    ("DE", "BE"): "53",  # Berlin
+    ("DE", "BB"): "52",  # Brandenburg
+    ("DE", "HB"): "56",  # Bremen
+    ("DE", "HH"): "58",  # Hamburg
+    ("DE", "HE"): "57",  # Hessen
+    ("DE", "MV"): "59",  # Mecklenburg-Vorpommern
+    ("DE", "NI"): "60",  # Niedersachsen
+    ("DE", "NW"): "61",  # Nordrhein-Westfalen
+    ("DE", "RP"): "62",  # Rheinland-Pfalz
+    ("DE", "SL"): "64",  # Saarland
+    ("DE", "SN"): "65",  # Sachsen
+    ("DE", "ST"): "66",  # Sachsen-Anhalt
+    ("DE", "SH"): "63",  # Schleswig-Holstein
+    ("DE", "TH"): "67",  # Thüringen
+}
+
+
+def _connect():
+    conn = connect(REFERENCE_DB)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reference_data (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            saved_at REAL NOT NULL,
+            data TEXT NOT NULL
+        )
+        """)
+    return conn
+
+
+def parse_countries(payload) -> tuple[dict, dict]:
+    """Return (country code -> id, (country code, state code) -> id)."""
+    if isinstance(payload, dict):
+        payload = payload.get("countries", [])
+    countries = {}
+    states = {}
+    for country in payload:
+        code = country.get("iso")
+        if not code or country.get("id") is None:
+            continue
+        countries[code] = str(country["id"])
+        for state in country.get("states") or []:
+            if state.get("abbr") and state.get("id") is not None:
+                states[(code, state["abbr"])] = str(state["id"])
+    return countries, states
+
+
+class ReferenceData:
+    """OFN country and state ids by ISO / state code.
+
+    Loaded from the local copy at start, refreshed from the OFN API when
+    that copy is older than REFERENCE_REFRESH_INTERVAL and seeded with
+    the German ids so addresses resolve even before the first fetch.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.countries = dict(SEED_COUNTRIES)
+        self.states = dict(SEED_STATES)
+        self.saved_at = 0.0
+
+    def _set(self, countries: dict, states: dict):
+        self.countries = {**SEED_COUNTRIES, **countries}
+        self.states = {**SEED_STATES, **states}
+
+    def load(self) -> bool:
+        """Load the persisted copy, if there is one."""
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT saved_at, data FROM reference_data WHERE id = 1"
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return False
+        self.saved_at, payload = row
+        data = json.loads(payload)
+        # JSON has no tuple keys, states are stored as [country, state, id]
+        self._set(
+            data["countries"], {(c, s): state_id for c, s, state_id in data["states"]}
+        )
+        return True
+
+    def save(self):
+        payload = json.dumps(
+            {
+                "countries": self.countries,
+                "states": [
+                    [c, s, state_id] for (c, s), state_id in self.states.items()
+                ],
+            }
+        )
+        self.saved_at = time.time()
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO reference_data (id, saved_at, data)"
+                    " VALUES (1, ?, ?)",
+                    (self.saved_at, payload),
+                )
+        finally:
+            conn.close()
+
+    async def refresh(self, ofn_api_key: str):
+        """Fetch countries and their states from OFN and persist them."""
+        response = await get_client().get(
+            COUNTRIES_URL,
+            headers={"Accept": "application/json", "X-Spree-Token": ofn_api_key},
+        )
+        response.raise_for_status()
+        countries, states = parse_countries(response.json())
+        if not countries:
+            raise Exception("OFN returned no countries.")
+        self._set(countries, states)
+        self.save()
+        print(
+            f"Reference data refreshed: {len(self.countries)} countries,"
+            f" {len(self.states)} states."
+        )
+
+    def country_id(self, country: dict | None) -> str:
+        if country and "code" in country:
+            return self.countries.get(country["code"], "")
+        return ""
+
+    def state_id(self, country: dict | None, region: dict | None) -> str:
+        if region and "code" in region:
+            country_code = (country or {}).get("code") or DEFAULT_COUNTRY_CODE
+            return self.states.get((country_code, region["code"]), "")
+        return ""
+
+    async def run(self, ofn_api_key: str):
+        """Keep the reference data fresh, meant to run as a background task."""
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Failed to load reference data: {e}")
+        while True:
+            delay = self.refresh_interval - (time.time() - self.saved_at)
+            if delay <= 0:
+                try:
+                    await self.refresh(ofn_api_key)
+                    delay = self.refresh_interval
+                except Exception as e:
+                    print(f"Failed to refresh reference data: {e}")
+                    delay = min(REFERENCE_RETRY_INTERVAL, self.refresh_interval)
+            await asyncio.sleep(delay)
+
+
+REFERENCE_DATA = ReferenceData(REFERENCE_REFRESH_INTERVAL)
@@ -0,0 +1,137 @@
+import heapq
+import re
+import unicodedata
+
+
+TOKEN_RE = re.compile(r"\w+")
+MAX_PREFIX_MATCHES = 500
+MIN_NGRAM_SIMILARITY = 0.3
+_IDS = ""
+
+
+def normalize_text(text) -> str:
+    """Casefold and strip accents, so "apfel" also finds "Äpfel"."""
+    text = unicodedata.normalize("NFKD", str(text or "")).casefold()
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text) -> list[str]:
+    return TOKEN_RE.findall(normalize_text(text))
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class PrefixTrie:
+    """Character trie mapping words to the ids of the products containing them."""
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, word: str, item_id):
+        node = self.root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node.setdefault(_IDS, set()).add(item_id)
+
+    def find(self, prefix: str, limit: int = MAX_PREFIX_MATCHES) -> set:
+        """Return ids of words starting with `prefix`, at most about `limit`."""
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return set()
+        found = set()
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            for key, child in node.items():
+                if key == _IDS:
+                    found.update(child)
+                else:
+                    stack.append(child)
+        return found
+
+
+class ProductSearch:
+    """Ranked name search over regular and weighted products.
+
+    Whole words and word prefixes are matched through a trie, typos and
+    partial words through a trigram index. Scores from both are combined
+    and the best `limit` products are returned.
+    """
+
+    def __init__(self, catalog: dict):
+        self.products = {}
+        self.names = {}
+        self.words = {}
+        self.trie = PrefixTrie()
+        self.ngrams = {}
+        for weighted, section in (
+            (False, "product_array"),
+            (True, "product_weight_array"),
+        ):
+            for variant in catalog.get(section, {}).values():
+                self._add(variant, weighted)
+
+    def _add(self, variant, weighted: bool):
+        item_id = variant.id
+        words = set(tokenize(variant.name))
+        if not words:
+            return
+        self.products[item_id] = (variant, weighted)
+        self.names[item_id] = normalize_text(variant.name)
+        self.words[item_id] = words
+        for word in words:
+            self.trie.insert(word, item_id)
+            for gram in trigrams(word):
+                self.ngrams.setdefault(gram, set()).add(item_id)
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores = {}
+        for token in tokens:
+            for item_id in self.trie.find(token):
+                exact = token in self.words[item_id]
+                scores[item_id] = scores.get(item_id, 0.0) + (3.0 if exact else 2.0)
+
+            grams = trigrams(token)
+            counts = {}
+            for gram in grams:
+                for item_id in self.ngrams.get(gram, ()):
+                    counts[item_id] = counts.get(item_id, 0) + 1
+            for item_id, count in counts.items():
+                similarity = count / len(grams)
+                if similarity >= MIN_NGRAM_SIMILARITY:
+                    scores[item_id] = scores.get(item_id, 0.0) + similarity
+
+        normalized_query = " ".join(tokens)
+        for item_id in scores:
+            if self.names[item_id].startswith(normalized_query):
+                scores[item_id] += 1.0
+
+        best = heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], -len(self.names[item[0]]))
+        )
+        results = []
+        for item_id, score in best:
+            variant, weighted = self.products[item_id]
+            results.append(
+                {
+                    "id": variant.id,
+                    "name": variant.name,
+                    "price": variant.price,
+                    "image": variant.image,
+                    "unit": variant.unit,
+                    "category_id": variant.category_id,
+                    "category_name": variant.category_name,
+                    "weighted": weighted,
+                    "score": round(score, 3),
+                }
+            )
+        return results
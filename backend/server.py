@@ -1,54 +1,30 @@
 import asyncio
-import serial
+import http
 import websockets
-import json
 import uuid
-import re
 import time
 
-from smartcard.System import readers
+from websockets.datastructures import Headers
+from websockets.http11 import Response
+
+import settings
+from checkout import CHECKOUT_JOBS
+from codec import dumps, loads
+from customer import CUSTOMER_DIRECTORY
+from draft_order import DRAFT_ORDERS
+from handlers import dispatch
+from image_cache import IMAGE_ROUTE, serve_image
+from outbox import OUTBOX
+from product import get_catalog, restore_catalog_snapshot
+from reference_data import REFERENCE_DATA
+from session_backend import SESSION_BACKEND
+from settings import checkout_args, load_settings
+from transport import close_transport
+from order import get_admin_session
 
-from api import get_nanostore_settings, IQToolAPI
-from card import get_card_uid_async
-from cart import (
-    get_cart_for_session,
-    add_product_to_cart,
-    update_cart_quantity,
-    remove_cart_item,
-    clear_cart,
-)
-from customer import fetch_customers, find_customer_by_code
-from product import load_products
-from scale import get_scale_port
-from relay import trigger_relay
-from order import create_ofn_order_from_session
 
-
-BAUDRATE = 9600
 WEBSOCKET_PORT = 8765
-
-# TODO: For production, you should use a more secure way to store session data.
-# For example, use a database or a secure cache like Redis.
-# Here we use a simple in-memory dictionary for demonstration purposes.
-# This will not persist across server restarts and is not thread-safe.
-# In a production environment, consider using a more robust session management solution.
-SESSION_CUSTOMERS = {}
-SESSION_LAST_ACTIVITY = {}
-
-OFN_API_KEY = get_nanostore_settings(key="OFN_API_KEY")
-OFN_ADMIN_EMAIL = get_nanostore_settings(key="OFN_ADMIN_EMAIL")
-OFN_ADMIN_PASSWORD = get_nanostore_settings(key="OFN_ADMIN_PASSWORD")
-OFN_SHOP_ID = get_nanostore_settings(key="OFN_SHOP_ID")
-ORDER_CYCLE_ID = get_nanostore_settings(key="ORDER_CYCLE_ID")
-OFN_PAYMENT_METHOD_ID = get_nanostore_settings(key="OFN_PAYMENT_METHOD_ID")
-TIMEOUT_RELAY = get_nanostore_settings(key="TIMEOUT_RELAY")
-TIMEOUT_SHOPPING_CART = get_nanostore_settings(key="TIMEOUT_SHOPPING_CART")
-
-api_service = IQToolAPI()
-
-
-def update_last_activity(session_id):
-    SESSION_LAST_ACTIVITY[session_id] = time.time()
+CATALOG_ROUTE = "/catalog"
 
 
 async def handle_websocket(websocket):
@@ -59,10 +35,12 @@ async def handle_websocket(websocket):
 
             # --- JSON-based protocol for Vue frontend ---
             try:
-                msg = json.loads(command)
+                msg = loads(command)
             except Exception:
                 await asyncio.sleep(0.01)
                 continue
+            if not isinstance(msg, dict):
+                continue
 
             # --- Session ID logic ---
             session_id = msg.get("session_id")
@@ -70,286 +48,115 @@ async def handle_websocket(websocket):
                 # Generate a new session_id and send it to the client
                 session_id = str(uuid.uuid4())
                 await websocket.send(
-                    json.dumps({"type": "session_id", "session_id": session_id})
-                )
-
-            # Open door (card scan listener) Entrance
-            if msg.get("type") == "open_door":
-                timeout = int(TIMEOUT_RELAY)
-                trigger_relay(timeout)
-                await websocket.send(json.dumps({"type": "open_door", "status": "OK"}))
-
-                code = msg.get("code")
-                is_entrance = True
-                customer_firstname = ""
-                customer_lastname = ""
-
-                try:
-                    customers = fetch_customers(OFN_API_KEY)
-                    customer_data = find_customer_by_code(code, customers)
-                    customer_firstname = customer_data.get("first_name", "")
-                    customer_lastname = customer_data.get("last_name", "")
-                except Exception as e:
-                    print(f"Error fetching customer data: {e}")
-                    is_entrance = False
-
-                # If customer_firstname/lastname are empty, treat as not granted
-                if not customer_firstname and not customer_lastname:
-                    is_entrance = False
-
-                payload = {
-                    "customer_firstname": customer_firstname,
-                    "customer_lastname": customer_lastname,
-                    "rfid_card_id": code,
-                    "is_entrance": is_entrance,
-                    "ofn_hub_id": OFN_SHOP_ID,
-                }
-                try:
-                    api_service.post("entrance-history/create/", payload)
-                    print(
-                        f"Entrance history logged to IQ Tool (is_entrance={is_entrance})."
-                    )
-                except Exception as e:
-                    print(f"Failed to log entrance history: {e}")
-
-            # Login (card scan listener) POS
-            elif msg and msg.get("type") == "login":
-                all_readers = readers()
-                if len(all_readers) > 1:
-                    device = str(all_readers[1])
-                else:
-                    device = str(all_readers[0])
-                card_uid = await get_card_uid_async(device)
-                await websocket.send(
-                    json.dumps({"type": "customer_code", "code": card_uid})
-                )
-
-            # Check code, log in the shopping cart
-            elif msg.get("type") == "check_customer_code":
-                code = msg.get("code")
-                customers = fetch_customers(OFN_API_KEY)
-                customer_data = find_customer_by_code(code, customers)
-                # Save customer data for this session
-                SESSION_CUSTOMERS[session_id] = customer_data
-                await websocket.send(
-                    json.dumps({"type": "customer_code_checked", **customer_data})
-                )
-
-            # Cart logic
-            elif msg.get("type") == "get_cart":
-                cart = get_cart_for_session(session_id)
-                await websocket.send(json.dumps({"type": "cart", "cart": cart}))
-
-            # Products load
-            elif msg.get("type") == "load_products":
-                products_data = load_products(OFN_API_KEY, OFN_SHOP_ID)
-                await websocket.send(
-                    json.dumps({"type": "load_products", **products_data})
+                    dumps({"type": "session_id", "session_id": session_id})
                 )
 
-            elif msg.get("type") == "check_product_code":
-                code = (
-                    str(msg.get("code", ""))
-                    .replace("Shift", "")
-                    .replace("Meta", "")
-                    .lower()
-                )
-                products_data = load_products(OFN_API_KEY, OFN_SHOP_ID)
-                product_array = products_data.get("product_array", {})
-                found = None
-                for key, p in product_array.items():
-                    item_code = str(p.get("sku", "")).lower()
-                    if item_code == code:
-                        found = {
-                            "exist": True,
-                            "id": key,
-                            "name": p.get("name"),
-                            "price": p.get("price"),
-                            "img": p.get("image"),
-                            "category_id": p.get("category_id"),
-                            "category_name": p.get("category_name"),
-                        }
-                        break
-                if found:
-                    await websocket.send(
-                        json.dumps({"type": "search_product_code", **found})
-                    )
-                else:
-                    # If not found by code, try by name (fallback)
-                    # You can optionally log this fallback
-                    name = code  # treat the code as a possible name
-                    product_weight_array = products_data.get("product_weight_array", {})
-                    found_name = None
-                    for p in product_weight_array.values():
-                        if p.get("name", "").lower() == name.lower():
-                            found_name = p
-                            break
-                    if found_name:
-                        response = {
-                            "type": "search_product_name",
-                            "exist": True,
-                            "product": {
-                                "id": found_name.get("id"),
-                                "name": found_name.get("name"),
-                                "price": found_name.get("price"),
-                                "image": found_name.get("image"),
-                                "category_id": found_name.get("category_id"),
-                                "category_name": found_name.get("category_name"),
-                            },
-                            "name": name,
-                        }
-                    else:
-                        response = {
-                            "type": "search_product_name",
-                            "exist": False,
-                            "name": name,
-                        }
-                    await websocket.send(json.dumps(response))
-
-            elif msg.get("type") == "add_to_cart":
-                update_last_activity(session_id)
-                product_data = {
-                    "id": msg["id"],
-                    "name": msg["name"],
-                    "price": msg["price"],
-                    "img": msg.get("img"),
-                    "category_id": msg.get("category_id"),
-                    "category_name": msg.get("category_name"),
-                }
-
-                # Add quantity and gramm for weighted products
-                if "quantity" in msg:
-                    product_data["quantity"] = msg["quantity"]
-                if "gramm" in msg:
-                    product_data["gramm"] = msg["gramm"]
-
-                add_product_to_cart(session_id, product_data)
-                cart = get_cart_for_session(session_id)
-                await websocket.send(json.dumps({"type": "cart", "cart": cart}))
-
-            elif msg.get("type") == "update_quantity":
-                update_last_activity(session_id)
-                update_cart_quantity(session_id, msg["id"], msg["quantity"])
-                cart = get_cart_for_session(session_id)
-                await websocket.send(json.dumps({"type": "cart", "cart": cart}))
-
-            elif msg.get("type") == "remove_item":
-                update_last_activity(session_id)
-                remove_cart_item(session_id, msg["id"])
-                cart = get_cart_for_session(session_id)
-                await websocket.send(json.dumps({"type": "cart", "cart": cart}))
+            # Handlers are registered by message type in the handlers package
+            await dispatch(websocket, session_id, msg)
 
-            elif msg.get("type") == "delete_cart":
-                clear_cart(session_id)
-                await websocket.send(json.dumps({"type": "cart_deleted"}))
+    except Exception as e:
+        print(f"Error in handle_websocket: {e}")
 
-            # Weight (for weighted products)
-            elif msg.get("type") == "weight":
-                port = get_scale_port()
-                if not port:
-                    await websocket.send(
-                        json.dumps({"type": "weight", "error": "Scale not found"})
-                    )
-                    continue
-                try:
-                    with serial.Serial(port, BAUDRATE, timeout=1) as ser:
-                        line = ser.readline().decode(errors="ignore")
-                        if line:
-                            match = re.search(r"([-+]?\d*\.\d+|\d+)", line)
-                            if match:
-                                weight = match.group(0)
-                                await websocket.send(
-                                    json.dumps({"type": "weight", "value": weight})
-                                )
-                except Exception as e:
-                    await websocket.send(
-                        json.dumps({"type": "weight", "error": str(e)})
-                    )
 
-            # Checkout logic
-            elif msg.get("type") == "checkout":
-                customer_data = SESSION_CUSTOMERS.get(session_id, {})
+def http_response(status: int, body: bytes, content_type: str, extra_headers=()):
+    headers = Headers(
+        [
+            ("Content-Type", content_type),
+            ("Content-Length", str(len(body))),
+            ("Access-Control-Allow-Origin", "*"),
+            *extra_headers,
+        ]
+    )
+    return Response(status, http.HTTPStatus(status).phrase, headers, body)
 
-                # Create order from session
-                order = create_ofn_order_from_session(
-                    session_id,
-                    OFN_API_KEY,
-                    OFN_ADMIN_EMAIL,
-                    OFN_ADMIN_PASSWORD,
-                    OFN_SHOP_ID,
-                    ORDER_CYCLE_ID,
-                    OFN_PAYMENT_METHOD_ID,
-                    customer_data,
-                )
 
-                await websocket.send(
-                    json.dumps({"type": "init_checkout", "order": order})
-                )
+async def process_http_request(connection, request):
+    """Serve plain HTTP routes (product images, catalog) on the websocket port."""
+    if request.path.startswith(IMAGE_ROUTE):
+        status, body, content_type = await serve_image(request.path)
+        return http_response(
+            status, body, content_type, [("Cache-Control", "public, max-age=86400")]
+        )
 
-            # Get confirmation msg from db
-            elif msg.get("type") == "get_confirmation":
-                confirmation = msg.get("confirmation")
-                # TODO: Get the value from the IQ database
-                value = "Your confirmation message here"
-                await websocket.send(
-                    json.dumps(
-                        {
-                            "type": "confirmation",
-                            "confirmation": confirmation,
-                            "value": value,
-                        }
-                    )
-                )
+    if request.path == CATALOG_ROUTE:
+        catalog = await get_catalog(settings.OFN_API_KEY, settings.OFN_SHOP_ID)
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            return http_response(
+                200,
+                catalog.payload_gzip(),
+                "application/json",
+                [("Content-Encoding", "gzip"), ("Vary", "Accept-Encoding")],
+            )
+        return http_response(200, catalog.payload(), "application/json")
 
-    except Exception as e:
-        print(f"Error in handle_websocket: {e}")
+    return None
 
 
 async def cart_timeout_watcher():
-    timeout = int(TIMEOUT_SHOPPING_CART)
+    timeout = int(settings.TIMEOUT_SHOPPING_CART)
     while True:
         now = time.time()
-        to_remove = []
-        for session_id, last_activity in list(SESSION_LAST_ACTIVITY.items()):
-            if now - last_activity > timeout:
-                cart = get_cart_for_session(session_id)
-                if not cart:
-                    # Cart is empty, just clean up the session
-                    print(
-                        f"Session {session_id} timed out, but cart is empty. Cleaning up session."
-                    )
-                    to_remove.append(session_id)
-                    continue
-                customer_data = SESSION_CUSTOMERS.get(session_id, {})
-                try:
-                    order = create_ofn_order_from_session(
-                        session_id,
-                        OFN_API_KEY,
-                        OFN_ADMIN_EMAIL,
-                        OFN_ADMIN_PASSWORD,
-                        OFN_SHOP_ID,
-                        ORDER_CYCLE_ID,
-                        OFN_PAYMENT_METHOD_ID,
-                        customer_data,
-                    )
-                    print(f"Session {session_id} timed out. Order created: {order}")
-                except Exception as e:
-                    print(f"Error creating order for session {session_id}: {e}")
-                to_remove.append(session_id)
-        # Clean up timed-out sessions
-        for session_id in to_remove:
-            SESSION_LAST_ACTIVITY.pop(session_id, None)
-            SESSION_CUSTOMERS.pop(session_id, None)
+        last_activity = await SESSION_BACKEND.last_activity()
+        for session_id, last_active in last_activity.items():
+            if now - last_active <= timeout:
+                continue
+            customer_data = await SESSION_BACKEND.get_customer(session_id)
+            # Another worker may have handled this timeout already
+            if not await SESSION_BACKEND.end_session(session_id):
+                continue
+            cart = await SESSION_BACKEND.get_cart(session_id, fresh=True)
+            if not cart.items():
+                # Cart is empty, just clean up the session
+                print(
+                    f"Session {session_id} timed out, but cart is empty. Cleaning up session."
+                )
+                DRAFT_ORDERS.release(session_id)
+                continue
+            job = CHECKOUT_JOBS.submit(session_id, checkout_args(customer_data))
+            print(f"Session {session_id} timed out. Checkout job {job.id} queued.")
         await asyncio.sleep(10)  # Check every 10 seconds
 
 
 async def main():
+    await load_settings()
+    # Carts and timeouts of sessions open before the last restart
+    await SESSION_BACKEND.start()
+    await DRAFT_ORDERS.start()
     print(f"Starting WebSocket server on ws://localhost:{WEBSOCKET_PORT}")
-    server = websockets.serve(handle_websocket, "localhost", WEBSOCKET_PORT)
-    await asyncio.gather(
-        server,
-        cart_timeout_watcher(),
+    server = websockets.serve(
+        handle_websocket,
+        "localhost",
+        WEBSOCKET_PORT,
+        process_request=process_http_request,
+        # The kiosk frontend runs on this machine, deflating every catalog
+        # payload again per client costs CPU and saves nothing
+        compression=None,
     )
+    # Serve the last good catalog right away, then refresh it from OFN
+    restore_catalog_snapshot()
+    asyncio.create_task(get_catalog(settings.OFN_API_KEY, settings.OFN_SHOP_ID))
+    # Log in to OFN admin now so checkouts skip the login round trip
+    asyncio.create_task(
+        get_admin_session(settings.OFN_ADMIN_EMAIL, settings.OFN_ADMIN_PASSWORD).warm()
+    )
+    try:
+        await asyncio.gather(
+            server,
+            cart_timeout_watcher(),
+            CUSTOMER_DIRECTORY.run(settings.OFN_API_KEY),
+            OUTBOX.run(),
+            CHECKOUT_JOBS.run(),
+            DRAFT_ORDERS.run(
+                settings.OFN_API_KEY,
+                settings.OFN_ADMIN_EMAIL,
+                settings.OFN_ADMIN_PASSWORD,
+            ),
+            REFERENCE_DATA.run(settings.OFN_API_KEY),
+            SESSION_BACKEND.run(),
+        )
+    finally:
+        await SESSION_BACKEND.close()
+        await close_transport()
     print("WebSocket server stopped.")
 
 
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from cart import Cart
+from customer import CUSTOMER_DIRECTORY
+from session_store import (
+    SESSION_DB,
+    SESSION_FLUSH_INTERVAL,
+    SessionStore,
+    customer_reference,
+)
+
+try:
+    import redis.asyncio as redis
+    from redis.exceptions import WatchError
+except ImportError:  # Only needed with SESSION_BACKEND=redis
+    redis = None
+
+
+SESSION_BACKEND_NAME = os.environ.get("SESSION_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.environ.get("REDIS_PREFIX", "nanostore:")
+# Carts of ended sessions are kept this long for the timeout checkout
+SESSION_CART_RETENTION = float(os.environ.get("SESSION_CART_RETENTION", 600))
+# Backoff between attempts to resubscribe to the invalidation channel
+REDIS_RECONNECT_MIN = 0.5
+REDIS_RECONNECT_MAX = 30
+
+
+class SessionBackend(ABC):
+    """Where session carts, customers and activity times are kept.
+
+    update_cart() is the only way carts change: it applies `mutate(cart)`
+    atomically and returns its result. Backends shared between processes
+    publish every change, and run() drops the local copies other processes
+    have invalidated.
+    """
+
+    async def start(self):
+        """Prepare the backend before the server accepts connections."""
+
+    async def run(self):
+        """Background work of the backend, runs forever."""
+        await asyncio.Event().wait()
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def get_cart(self, session_id: str, fresh: bool = False) -> Cart:
+        """Return the session's cart.
+
+        Backends may serve a local copy that lags behind changes made by
+        other processes, `fresh` reads the stored cart instead. Use it when
+        acting on the cart, e.g. for checkout.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_cart(self, session_id: str, mutate):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_customer(self, session_id: str) -> dict:
+        raise NotImplementedError
+
+    async def get_customer_reference(self, session_id: str) -> dict:
+        """The customer's exist flag, id and card code, without any lookup."""
+        return customer_reference(await self.get_customer(session_id))
+
+    @abstractmethod
+    async def set_customer(self, session_id: str, customer: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def touch(self, session_id: str):
+        """Record activity on the session now."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def last_activity(self) -> dict:
+        """Return {session_id: last activity time} of all open sessions."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def end_session(self, session_id: str) -> bool:
+        """Close the session, True only for the caller that actually closed it.
+
+        The cart stays readable for SESSION_CART_RETENTION seconds, so a
+        timed out session can still be checked out, and is dropped after.
+        """
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """Sessions in this process, persisted by the write-behind SessionStore."""
+
+    def __init__(self):
+        self.carts = {}
+        self.customers = {}
+        # Restored sessions whose customer is only the stored reference yet
+        self.unresolved = set()
+        self.activity = {}
+        self.store = SessionStore(SESSION_DB, self.snapshot, SESSION_FLUSH_INTERVAL)
+
+    def snapshot(self, session_id: str):
+        """Persisted state of a session, None once it has ended."""
+        if session_id not in self.activity and session_id not in self.customers:
+            return None
+        cart = self.carts.get(session_id) or Cart()
+        return (
+            cart.to_dict(),
+            customer_reference(self.customers.get(session_id, {})),
+            self.activity.get(session_id),
+        )
+
+    async def start(self):
+        """Bring back the carts and timeouts of sessions open before a restart."""
+        try:
+            sessions = self.store.load()
+        except Exception as e:
+            print(f"Failed to restore sessions: {e}")
+            return
+        for session_id, (cart, customer, last_activity) in sessions.items():
+            self.carts[session_id] = Cart.from_dict(cart)
+            if customer:
+                self.customers[session_id] = customer
+                self.unresolved.add(session_id)
+                # Rows written before only references were kept are replaced
+                self.store.mark(session_id)
+            if last_activity is not None:
+                self.activity[session_id] = last_activity
+        if sessions:
+            print(f"Restored {len(sessions)} sessions.")
+
+    async def run(self):
+        await self.store.run()
+
+    async def close(self):
+        self.store.flush()
+
+    async def get_cart(self, session_id: str, fresh: bool = False) -> Cart:
+        cart = self.carts.get(session_id)
+        if cart is None:
+            cart = self.carts[session_id] = Cart()
+        return cart
+
+    async def update_cart(self, session_id: str, mutate):
+        # Nothing else runs between reading and changing the cart here
+        result = mutate(await self.get_cart(session_id))
+        self.store.mark(session_id)
+        return result
+
+    async def get_customer(self, session_id: str) -> dict:
+        customer = self.customers.get(session_id, {})
+        if session_id in self.unresolved:
+            # Only from the loaded directory, OFN may not be reachable yet
+            record = CUSTOMER_DIRECTORY.find(customer.get("code"))
+            if record.get("exist") and str(record.get("id")) == str(customer.get("id")):
+                self.customers[session_id] = customer = record
+                self.unresolved.discard(session_id)
+        return customer
+
+    async def get_customer_reference(self, session_id: str) -> dict:
+        return customer_reference(self.customers.get(session_id, {}))
+
+    async def set_customer(self, session_id: str, customer: dict):
+        self.customers[session_id] = customer
+        self.unresolved.discard(session_id)
+        self.store.mark(session_id)
+
+    async def touch(self, session_id: str):
+        self.activity[session_id] = time.time()
+        self.store.mark(session_id)
+
+    async def last_activity(self) -> dict:
+        return dict(self.activity)
+
+    async def end_session(self, session_id: str) -> bool:
+        self.customers.pop(session_id, None)
+        self.unresolved.discard(session_id)
+        ended = self.activity.pop(session_id, None) is not None
+        self.store.mark(session_id)
+        asyncio.get_running_loop().call_later(
+            SESSION_CART_RETENTION, self._drop_cart, session_id
+        )
+        return ended
+
+    def _drop_cart(self, session_id: str):
+        # The session may have been used again since it ended
+        if session_id not in self.activity and session_id not in self.customers:
+            self.carts.pop(session_id, None)
+
+
+class RedisSessionBackend(SessionBackend):
+    """Sessions in Redis, shared by every backend process and terminal.
+
+    Carts are JSON values changed with WATCH / MULTI transactions, activity
+    times live in one sorted set. Each process keeps the carts it has read
+    and drops them when another process announces a change on the
+    invalidation channel. Works with any redis.asyncio compatible client,
+    e.g. fakeredis for local testing.
+    """
+
+    def __init__(self, client, prefix: str = REDIS_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        self.channel = f"{prefix}invalidate"
+        self.origin = uuid.uuid4().hex
+        self.carts = {}
+
+    def _key(self, kind: str, session_id: str) -> str:
+        return f"{self.prefix}{kind}:{session_id}"
+
+    async def _publish(self, session_id: str):
+        await self.client.publish(self.channel, f"{self.origin} {session_id}")
+
+    async def run(self):
+        """Drop local carts changed by other processes.
+
+        A lost connection is retried with backoff. All local carts are
+        dropped on resubscribing, invalidations may have been missed.
+        """
+        delay = REDIS_RECONNECT_MIN
+        while True:
+            started = time.monotonic()
+            try:
+                await self._listen()
+            except Exception as e:
+                print(f"Lost the Redis invalidation channel: {e}")
+            if time.monotonic() - started > REDIS_RECONNECT_MAX:
+                # It was connected for a while, start the backoff over
+                delay = REDIS_RECONNECT_MIN
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, REDIS_RECONNECT_MAX)
+
+    async def _listen(self):
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            self.carts.clear()
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                data = message["data"]
+                if isinstance(data, bytes):
+                    data = data.decode()
+                origin, _, session_id = data.partition(" ")
+                if origin != self.origin:
+                    self.carts.pop(session_id, None)
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def get_cart(self, session_id: str, fresh: bool = False) -> Cart:
+        cart = None if fresh else self.carts.get(session_id)
+        if cart is None:
+            raw = await self.client.get(self._key("cart", session_id))
+            cart = Cart.from_dict(json.loads(raw)) if raw else Cart()
+            self.carts[session_id] = cart
+        return cart
+
+    async def update_cart(self, session_id: str, mutate):
+        key = self._key("cart", session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    cart = Cart.from_dict(json.loads(raw)) if raw else Cart()
+                    result = mutate(cart)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(cart.to_dict()))
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    # Another terminal changed the cart, apply to the new one
+                    continue
+        self.carts[session_id] = cart
+        await self._publish(session_id)
+        return result
+
+    async def get_customer(self, session_id: str) -> dict:
+        raw = await self.client.get(self._key("customer", session_id))
+        return json.loads(raw) if raw else {}
+
+    async def set_customer(self, session_id: str, customer: dict):
+        await self.client.set(self._key("customer", session_id), json.dumps(customer))
+
+    async def touch(self, session_id: str):
+        await self.client.zadd(f"{self.prefix}activity", {session_id: time.time()})
+
+    async def last_activity(self) -> dict:
+        entries = await self.client.zrange(
+            f"{self.prefix}activity", 0, -1, withscores=True
+        )
+        return {
+            (member.decode() if isinstance(member, bytes) else member): score
+            for member, score in entries
+        }
+
+    async def end_session(self, session_id: str) -> bool:
+        # ZREM is atomic, so only one process gets to handle the timeout
+        ended = await self.client.zrem(f"{self.prefix}activity", session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key("customer", session_id))
+            # Any later change of the cart sets it again without expiry
+            pipe.pexpire(
+                self._key("cart", session_id), int(SESSION_CART_RETENTION * 1000)
+            )
+            await pipe.execute()
+        self.carts.pop(session_id, None)
+        await self._publish(session_id)
+        return bool(ended)
+
+
+def create_session_backend(name: str = SESSION_BACKEND_NAME) -> SessionBackend:
+    if name == "redis":
+        if redis is None:
+            raise Exception("SESSION_BACKEND=redis needs the redis package.")
+        return RedisSessionBackend(redis.from_url(REDIS_URL))
+    return MemorySessionBackend()
+
+
+SESSION_BACKEND = create_session_backend()
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import time
+
+from storage import connect
+
+
+SESSION_DB = "sessions.sqlite3"
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", 1))
+# Names, addresses and the IBAN are looked up again instead of stored
+CUSTOMER_REFERENCE_FIELDS = ("exist", "id", "code")
+
+
+def customer_reference(customer: dict) -> dict:
+    """The part of a customer record that is written to disk."""
+    return {
+        field: customer[field]
+        for field in CUSTOMER_REFERENCE_FIELDS
+        if field in customer
+    }
+
+
+class SessionStore:
+    """Write-behind SQLite copy of the in-memory session state.
+
+    Handlers keep changing the in-memory carts and dicts and only mark the
+    session as dirty. The run() task writes all dirty sessions in one
+    transaction every SESSION_FLUSH_INTERVAL seconds, reading their current
+    state through `snapshot(session_id)`, which returns (cart dict, customer
+    reference, last activity) or None once the session is gone.
+    """
+
+    def __init__(self, filename: str, snapshot, flush_interval: float):
+        self.filename = filename
+        self.snapshot = snapshot
+        self.flush_interval = flush_interval
+        self.dirty = set()
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = connect(self.filename)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    cart TEXT NOT NULL,
+                    customer TEXT NOT NULL,
+                    last_activity REAL,
+                    saved_at REAL NOT NULL
+                )
+                """)
+        return self._conn
+
+    def mark(self, session_id: str):
+        """Schedule the session to be written with the next flush."""
+        self.dirty.add(session_id)
+
+    def flush(self) -> int:
+        """Write every dirty session now, return how many were written."""
+        if not self.dirty:
+            return 0
+        dirty, self.dirty = self.dirty, set()
+        now = time.time()
+        rows = []
+        removed = []
+        for session_id in dirty:
+            state = self.snapshot(session_id)
+            if state is None:
+                removed.append((session_id,))
+                continue
+            cart, customer, last_activity = state
+            rows.append(
+                (session_id, json.dumps(cart), json.dumps(customer), last_activity, now)
+            )
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO sessions"
+                    " (session_id, cart, customer, last_activity, saved_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self.conn.executemany(
+                    "DELETE FROM sessions WHERE session_id = ?", removed
+                )
+        except Exception:
+            # Keep them for the next attempt
+            self.dirty |= dirty
+            raise
+        return len(dirty)
+
+    def load(self) -> dict:
+        """Return {session_id: (cart dict, customer, last activity)}."""
+        return {
+            session_id: (json.loads(cart), json.loads(customer), last_activity)
+            for session_id, cart, customer, last_activity in self.conn.execute(
+                "SELECT session_id, cart, customer, last_activity FROM sessions"
+            )
+        }
+
+    async def run(self):
+        """Flush dirty sessions periodically, runs forever."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to save sessions: {e}")
@@ -0,0 +1,58 @@
+import asyncio
+
+from api import get_nanostore_settings
+
+
+# Loaded from IQ Tool by load_settings() before the server starts, read them
+# as attributes of this module so the loaded values are seen everywhere
+OFN_API_KEY = None
+OFN_ADMIN_EMAIL = None
+OFN_ADMIN_PASSWORD = None
+OFN_SHOP_ID = None
+ORDER_CYCLE_ID = None
+OFN_PAYMENT_METHOD_ID = None
+TIMEOUT_RELAY = None
+TIMEOUT_SHOPPING_CART = None
+
+
+async def load_settings():
+    """Fetch the Nanostore settings from IQ Tool concurrently."""
+    global OFN_API_KEY, OFN_ADMIN_EMAIL, OFN_ADMIN_PASSWORD, OFN_SHOP_ID
+    global ORDER_CYCLE_ID, OFN_PAYMENT_METHOD_ID, TIMEOUT_RELAY, TIMEOUT_SHOPPING_CART
+    (
+        OFN_API_KEY,
+        OFN_ADMIN_EMAIL,
+        OFN_ADMIN_PASSWORD,
+        OFN_SHOP_ID,
+        ORDER_CYCLE_ID,
+        OFN_PAYMENT_METHOD_ID,
+        TIMEOUT_RELAY,
+        TIMEOUT_SHOPPING_CART,
+    ) = await asyncio.gather(
+        get_nanostore_settings(key="OFN_API_KEY"),
+        get_nanostore_settings(key="OFN_ADMIN_EMAIL"),
+        get_nanostore_settings(key="OFN_ADMIN_PASSWORD"),
+        get_nanostore_settings(key="OFN_SHOP_ID"),
+        get_nanostore_settings(key="ORDER_CYCLE_ID"),
+        get_nanostore_settings(key="OFN_PAYMENT_METHOD_ID"),
+        get_nanostore_settings(key="TIMEOUT_RELAY"),
+        get_nanostore_settings(key="TIMEOUT_SHOPPING_CART"),
+    )
+
+
+def checkout_args(customer_data: dict) -> tuple:
+    """Arguments for create_ofn_order_from_session after the session id."""
+    return (
+        OFN_API_KEY,
+        OFN_ADMIN_EMAIL,
+        OFN_ADMIN_PASSWORD,
+        OFN_SHOP_ID,
+        ORDER_CYCLE_ID,
+        OFN_PAYMENT_METHOD_ID,
+        customer_data,
+    )
+
+
+def draft_args() -> tuple:
+    """Arguments for prepare_order before the customer data."""
+    return (OFN_ADMIN_EMAIL, OFN_ADMIN_PASSWORD, OFN_SHOP_ID, ORDER_CYCLE_ID)
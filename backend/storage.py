@@ -0,0 +1,17 @@
+import os
+import sqlite3
+
+
+# Kept outside the checkout, update.sh replaces the whole nanostore directory.
+DATA_DIR = os.environ.get(
+    "NANOSTORE_DATA_DIR", os.path.join(os.path.expanduser("~"), ".nanostore")
+)
+
+
+def connect(filename: str) -> sqlite3.Connection:
+    """Open a SQLite database in the data directory in WAL mode."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DATA_DIR, filename))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
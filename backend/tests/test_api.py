@@ -0,0 +1,120 @@
+import asyncio
+import base64
+import json
+
+import httpx
+
+import api
+from api import JWT_REFRESH_MARGIN, IQToolAPI, jwt_expiry
+
+
+def jwt(exp: float) -> str:
+    claims = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode()
+    return f"header.{claims.rstrip('=')}.signature"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class IQTool:
+    """Mock IQ Tool issuing a new JWT valid for an hour on every login."""
+
+    def __init__(self, clock: Clock):
+        self.clock = clock
+        self.logins = 0
+        self.rejected = set()
+        self.seen = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/token-obtain/"):
+            self.logins += 1
+            # Let concurrent callers pile up behind the login
+            await asyncio.sleep(0.01)
+            token = jwt(self.clock.now + 3600) + str(self.logins)
+            return httpx.Response(200, json={"token": token})
+        token = request.headers["Authorization"].removeprefix("JWT ")
+        self.seen.append(token)
+        if token in self.rejected:
+            return httpx.Response(401)
+        return httpx.Response(200, json={"value": "ok"})
+
+
+def iqtool(monkeypatch) -> tuple[IQToolAPI, IQTool, Clock]:
+    clock = Clock()
+    server = IQTool(clock)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+    monkeypatch.setattr(api, "time", clock)
+    monkeypatch.setattr(api, "get_client", lambda: client)
+    return IQToolAPI(), server, clock
+
+
+def test_jwt_expiry_reads_the_exp_claim():
+    assert jwt_expiry(jwt(1234)) == 1234
+    assert jwt_expiry("not-a-jwt") is None
+
+
+def test_token_is_reused_and_refreshed_before_it_expires(monkeypatch):
+    service, server, clock = iqtool(monkeypatch)
+
+    async def scenario():
+        await service.get("nanostore-settings/")
+        clock.now += 3600 - JWT_REFRESH_MARGIN - 1
+        await service.get("nanostore-settings/")
+        clock.now += 1
+        await service.get("nanostore-settings/")
+
+    asyncio.run(scenario())
+    assert server.logins == 2
+    assert server.seen[0] == server.seen[1] != server.seen[2]
+
+
+def test_401_logs_in_again_exactly_once(monkeypatch):
+    service, server, _ = iqtool(monkeypatch)
+
+    async def scenario():
+        await service.get("nanostore-settings/")
+        # Revoked on the server, although its exp is still in the future
+        server.rejected.add(service.jwt_token)
+        return await service.get("nanostore-settings/")
+
+    assert asyncio.run(scenario()) == {"value": "ok"}
+    assert server.logins == 2
+    assert len(server.seen) == 3
+
+
+def test_401_after_the_new_login_is_raised(monkeypatch):
+    service, server, _ = iqtool(monkeypatch)
+
+    async def reject_all(request: httpx.Request) -> httpx.Response:
+        response = await IQTool.handler(server, request)
+        if response.status_code == 200 and "token-obtain" not in str(request.url):
+            return httpx.Response(401)
+        return response
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(reject_all))
+    monkeypatch.setattr(api, "get_client", lambda: client)
+
+    async def scenario():
+        try:
+            await service.get("nanostore-settings/")
+        except httpx.HTTPStatusError as e:
+            return e.response.status_code
+
+    assert asyncio.run(scenario()) == 401
+    assert server.logins == 2
+
+
+def test_concurrent_callers_share_one_login(monkeypatch):
+    service, server, _ = iqtool(monkeypatch)
+
+    async def scenario():
+        await asyncio.gather(*(service.get("nanostore-settings/") for _ in range(10)))
+
+    asyncio.run(scenario())
+    assert server.logins == 1
+    assert len(set(server.seen)) == 1
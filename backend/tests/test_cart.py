@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from cart import Cart
+
+
+def product(variant_id: int, price: str, **extra) -> dict:
+    return {"id": variant_id, "name": f"Product {variant_id}", "price": price, **extra}
+
+
+def test_totals_are_exact_decimals():
+    cart = Cart()
+    for _ in range(3):
+        cart.add(product(1, "0.10"))
+    cart.add(product(2, "0.20", quantity=2))
+    assert cart.total == Decimal("0.70")
+    assert cart.item_count == 5
+    assert len(cart) == 2
+
+
+def test_weighted_products_get_a_slot_per_weighing():
+    cart = Cart()
+    first = cart.add(product(5, "1.87", gramm=340))
+    second = cart.add(product(5, "2.09", gramm=380))
+    assert first != second
+    assert [line["quantity"] for line in cart.items()] == [1, 1]
+    assert cart.total == Decimal("3.96")
+    assert cart.find_line(5) == first
+
+
+def test_update_and_remove_keep_totals_in_step():
+    cart = Cart()
+    cart.add(product(1, "1.10"))
+    cart.add(product(2, "1.87", gramm=340))
+    cart.add(product(2, "2.09", gramm=380))
+    assert cart.update_quantity(1, 4) == ["1"]
+    assert cart.total == Decimal("8.36")
+    assert len(cart.remove(2)) == 2
+    assert cart.total == Decimal("4.40")
+    assert cart.item_count == 4
+    assert cart.remove(2) == []
+    assert cart.update_quantity(9, 1) == []
+
+
+def test_version_counts_changes():
+    cart = Cart()
+    cart.add(product(1, "1.10"))
+    cart.update_quantity(1, 2)
+    cart.remove(3)
+    cart.clear()
+    assert cart.version == 3
+    assert cart.total == 0 and cart.item_count == 0
+
+
+def test_round_trip_keeps_prices_slots_and_version():
+    cart = Cart()
+    cart.add(product(1, "1.10"))
+    cart.add(product(2, "1.87", gramm=340))
+    restored = Cart.from_dict(cart.to_dict())
+    assert restored.items() == cart.items()
+    assert restored.total == cart.total
+    assert restored.version == cart.version
+    # The next weighing does not reuse a restored slot
+    assert restored.add(product(2, "2.09", gramm=380)) not in cart.lines
+
+
+def test_patch_message_marks_removed_lines_null():
+    cart = Cart()
+    cart.add(product(1, "1.10"))
+    base_version = cart.version
+    keys = cart.remove(1)
+    message = cart.patch_message(base_version, keys)
+    assert message["lines"] == [{"key": "1", "line": None}]
+    assert (message["base_version"], message["version"]) == (1, 2)
+    assert message["total"] == "0.00"
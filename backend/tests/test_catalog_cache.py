@@ -0,0 +1,71 @@
+import asyncio
+
+import catalog_cache
+from catalog_cache import CatalogCache
+
+
+class Clock:
+    """time.monotonic() of a kiosk that booted two minutes ago."""
+
+    def __init__(self):
+        self.now = 120.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def counting_loader():
+    calls = []
+
+    async def load(*args):
+        calls.append(args)
+        return f"catalog {len(calls)}"
+
+    return load, calls
+
+
+def test_invalidate_refreshes_on_the_next_read_right_after_boot(monkeypatch):
+    monkeypatch.setattr(catalog_cache, "time", Clock())
+    load, calls = counting_loader()
+    cache = CatalogCache(load, ttl=300)
+
+    async def scenario():
+        first = await cache.get("key")
+        cache.invalidate()
+        stale = await cache.get("key")
+        await cache._refresh_task
+        return first, stale, cache.data
+
+    assert asyncio.run(scenario()) == ("catalog 1", "catalog 1", "catalog 2")
+    assert len(calls) == 2
+
+
+def test_fresh_catalog_is_not_reloaded(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(catalog_cache, "time", clock)
+    load, calls = counting_loader()
+    cache = CatalogCache(load, ttl=300)
+
+    async def scenario():
+        await cache.get("key")
+        clock.now += 299
+        await cache.get("key")
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert cache._refresh_task is None
+
+
+def test_primed_catalog_refreshes_on_the_next_get(monkeypatch):
+    monkeypatch.setattr(catalog_cache, "time", Clock())
+    load, calls = counting_loader()
+    cache = CatalogCache(load, ttl=300)
+
+    async def scenario():
+        cache.prime("snapshot")
+        served = await cache.get("key")
+        await cache._refresh_task
+        return served, cache.data
+
+    assert asyncio.run(scenario()) == ("snapshot", "catalog 1")
+    assert calls == [("key",)]
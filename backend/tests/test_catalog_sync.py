@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+
+import httpx
+
+from catalog_sync import CatalogSync, diff_catalog
+
+
+PRODUCTS_URL = "https://ofn.test/products"
+TAXONS_URL = "https://ofn.test/taxons"
+
+
+class Upstream:
+    """Mock OFN that answers conditional GETs with ETags."""
+
+    def __init__(self):
+        self.bodies = {PRODUCTS_URL: [{"id": 1}], TAXONS_URL: [{"name": "Fruit"}]}
+        self.failing = set()
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if url in self.failing:
+            return httpx.Response(503)
+        content = json.dumps(self.bodies[url]).encode()
+        etag = hashlib.md5(content).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=content, headers={"ETag": etag})
+
+
+def sync_once(sync: CatalogSync, upstream: Upstream):
+    """Fetch both URLs like load_catalog, committing only if both succeed."""
+
+    async def scenario():
+        transport = httpx.MockTransport(upstream.handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            results = await asyncio.gather(
+                sync.get_json(client, PRODUCTS_URL, {}),
+                sync.get_json(client, TAXONS_URL, {}),
+                return_exceptions=True,
+            )
+        if any(isinstance(result, Exception) for result in results):
+            sync.discard()
+            return None
+        sync.commit()
+        return results
+
+    return asyncio.run(scenario())
+
+
+def test_unchanged_payload_is_reported_unchanged():
+    sync, upstream = CatalogSync(), Upstream()
+    first = sync_once(sync, upstream)
+    second = sync_once(sync, upstream)
+    assert [changed for changed, _ in first] == [True, True]
+    assert [changed for changed, _ in second] == [False, False]
+    assert second[1][1] == [{"name": "Fruit"}]
+
+
+def test_change_survives_a_failed_sync():
+    sync, upstream = CatalogSync(), Upstream()
+    sync_once(sync, upstream)
+
+    upstream.bodies[TAXONS_URL] = [{"name": "Vegetables"}]
+    upstream.failing.add(PRODUCTS_URL)
+    assert sync_once(sync, upstream) is None
+
+    upstream.failing.clear()
+    (products_changed, _), (taxons_changed, taxons) = sync_once(sync, upstream)
+    assert not products_changed
+    assert taxons_changed
+    assert taxons == [{"name": "Vegetables"}]
+
+
+def test_discarded_sync_keeps_previous_payload():
+    sync, upstream = CatalogSync(), Upstream()
+    sync_once(sync, upstream)
+    upstream.bodies[TAXONS_URL] = [{"name": "Vegetables"}]
+    upstream.failing.add(PRODUCTS_URL)
+    sync_once(sync, upstream)
+    assert sync.payloads[TAXONS_URL] == [{"name": "Fruit"}]
+    assert sync.pending == {}
+
+
+def test_diff_catalog_reports_added_changed_and_removed_variants():
+    old = {
+        "product_array": {1: "apple", 2: "pear"},
+        "product_weight_array": {3: "potato"},
+        "taxes_array": {},
+    }
+    new = {
+        "product_array": {1: "apple", 2: "nashi pear", 4: "plum"},
+        "product_weight_array": {},
+        "taxes_array": {},
+    }
+    assert diff_catalog(old, new) == {
+        "product_array": {
+            "added": {4: "plum"},
+            "changed": {2: "nashi pear"},
+            "removed": [],
+        },
+        "product_weight_array": {"added": {}, "changed": {}, "removed": [3]},
+    }
+
+
+def test_diff_catalog_of_equal_catalogs_is_none():
+    catalog = {
+        "product_array": {1: "apple"},
+        "product_weight_array": {},
+        "taxes_array": {},
+    }
+    assert diff_catalog(catalog, dict(catalog)) is None
@@ -0,0 +1,52 @@
+import asyncio
+
+import checkout
+from checkout import CheckoutQueue
+
+
+def collect(messages: list):
+    """A notify callback that appends every message to `messages`."""
+
+    async def notify(message):
+        messages.append(message)
+
+    return notify
+
+
+def test_resubmitted_checkout_notifies_every_caller(monkeypatch):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def create_order(session_id, *args, progress, order_id):
+        started.set()
+        await release.wait()
+        return {"order_id": "R1"}
+
+    async def no_draft(session_id):
+        return None
+
+    monkeypatch.setattr(checkout, "create_ofn_order_from_session", create_order)
+    monkeypatch.setattr(checkout.DRAFT_ORDERS, "claim", no_draft)
+
+    async def scenario():
+        queue = CheckoutQueue(workers=1)
+        received = {"page": [], "reloaded": []}
+        worker = asyncio.create_task(queue.run())
+        first = queue.submit("s1", (), notify=collect(received["page"]))
+        await started.wait()
+        # The timeout watcher and a reloaded page submit the same session again
+        watcher = queue.submit("s1", ())
+        reloaded = queue.submit("s1", (), notify=collect(received["reloaded"]))
+        release.set()
+        await queue.queue.join()
+        worker.cancel()
+        return first, watcher, reloaded, received
+
+    first, watcher, reloaded, received = asyncio.run(scenario())
+    assert first is watcher is reloaded
+    for messages in received.values():
+        assert messages[-1] == {
+            "type": "init_checkout",
+            "order": {"order_id": "R1"},
+            "job_id": first.id,
+        }
@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+
+import customer
+from customer import CustomerDirectory
+
+
+def ofn_customers(monkeypatch, pages: list) -> None:
+    """Answer /api/v1/customers from `pages`, an HTTP status for an outage."""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if isinstance(pages[0], int):
+            return httpx.Response(pages[0])
+        return httpx.Response(200, json={"data": pages[0], "links": {}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(customer, "get_client", lambda: client)
+
+
+def member(code: str) -> dict:
+    return {
+        "id": 7,
+        "attributes": {"first_name": "Ada", "last_name": "Lovelace", "tags": [code]},
+    }
+
+
+def test_lookup_finds_card_codes_case_insensitively(monkeypatch):
+    ofn_customers(monkeypatch, [[member("code:AB12")]])
+    directory = CustomerDirectory(300, 30)
+    record = asyncio.run(directory.lookup("key", "ab12"))
+    assert record["exist"] and record["full_name"] == "Ada Lovelace"
+    assert directory.healthy
+
+
+def test_lookup_during_an_outage_is_not_healthy(monkeypatch):
+    ofn_customers(monkeypatch, [503])
+    directory = CustomerDirectory(300, 30)
+    assert asyncio.run(directory.lookup("key", "ab12")) == {"exist": False}
+    assert not directory.healthy
+
+
+def test_failed_refresh_of_a_loaded_directory_is_not_healthy(monkeypatch):
+    pages = [[member("code:AB12")]]
+    ofn_customers(monkeypatch, pages)
+    directory = CustomerDirectory(300, 0)
+    asyncio.run(directory.refresh("key"))
+    pages[0] = 503
+    assert asyncio.run(directory.lookup("key", "new-card")) == {"exist": False}
+    assert not directory.healthy
+    # Known cards are still answered from the last good copy
+    assert asyncio.run(directory.lookup("key", "ab12"))["exist"]
+
+
+def paged_customers(monkeypatch, pages: list, style: str) -> list:
+    """Serve `pages` with next links or page counts, returning the requested pages."""
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        requested.append((page, int(request.url.params["per_page"])))
+        body = {"data": pages[page - 1]}
+        if style == "links":
+            body["links"] = {"next": "…" if page < len(pages) else None}
+        else:
+            body["meta"] = {"pagination": {"pages": len(pages)}}
+        return httpx.Response(200, json=body)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(customer, "get_client", lambda: client)
+    return requested
+
+
+def collect_customers(per_page: int) -> list[dict]:
+    async def scenario():
+        return [c async for c in customer.iter_customers("key", per_page=per_page)]
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("style", ["links", "meta"])
+def test_every_page_is_fetched(monkeypatch, style):
+    pages = [
+        [member(f"code:c{i}") for i in range(2)],
+        [member(f"code:c{i}") for i in range(2, 4)],
+        [member("code:c4")],
+    ]
+    requested = paged_customers(monkeypatch, pages, style)
+    customers = collect_customers(per_page=2)
+    assert requested == [(1, 2), (2, 2), (3, 2)]
+    assert [c["tags"] for c in customers] == [[f"code:c{i}"] for i in range(5)]
+
+
+def test_an_empty_page_ends_the_listing(monkeypatch):
+    pages = [[member("code:c0")], [], [member("code:c1")]]
+    requested = paged_customers(monkeypatch, pages, "meta")
+    # The pagination claims a third page, the empty second one still stops it
+    assert len(collect_customers(per_page=1)) == 1
+    assert [page for page, _ in requested] == [1, 2]
+
+
+def test_only_kiosk_fields_are_kept(monkeypatch):
+    item = member("code:ab12")
+    item["attributes"].update({"id": 7, "code": "x", "balance": "12.00"})
+    paged_customers(monkeypatch, [[item]], "links")
+    (kept,) = collect_customers(per_page=100)
+    assert set(kept) == {"first_name", "last_name", "tags", "id", "enterprise_id"}
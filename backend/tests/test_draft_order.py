@@ -0,0 +1,26 @@
+import asyncio
+import time
+
+import storage
+from draft_order import DRAFT_ORDER_MAX_AGE, DraftOrder, DraftOrders
+
+
+def test_abandoned_draft_is_cancelled_after_max_age(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+
+    async def scenario():
+        drafts = DraftOrders("drafts.sqlite3")
+        task = asyncio.get_running_loop().create_future()
+        task.set_result("R1")
+        old = DraftOrder(7, task, time.time() - DRAFT_ORDER_MAX_AGE - 1)
+        fresh_task = asyncio.get_running_loop().create_future()
+        fresh_task.set_result("R2")
+        drafts.drafts = {"gone": old, "shopping": DraftOrder(8, fresh_task)}
+        drafts._expire()
+        # Done callbacks run on the next loop iteration
+        await asyncio.sleep(0)
+        return drafts
+
+    drafts = asyncio.run(scenario())
+    assert list(drafts.drafts) == ["shopping"]
+    assert drafts.to_cancel == {"R1"}
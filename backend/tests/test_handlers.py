@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+
+from handlers.registry import HANDLERS, PRICE, Handler, dispatch, handler
+
+
+class FakeWebsocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+async def noop(websocket, session_id, msg):
+    pass
+
+
+@pytest.mark.parametrize("price", ["1.10", "2", 3, 0.5])
+def test_price_accepts_numbers_and_numeric_strings(price):
+    assert Handler(noop, {"price": PRICE}, {}).validate({"price": price}) == []
+
+
+@pytest.mark.parametrize("price", ["abc", "", "NaN", "Infinity", True, [1]])
+def test_price_rejects_anything_else(price):
+    errors = Handler(noop, {"price": PRICE}, {}).validate({"price": price})
+    assert errors == ["price has the wrong type"]
+
+
+def test_failing_handler_is_answered_instead_of_raising():
+    @handler("test_failing_handler")
+    async def failing(websocket, session_id, msg):
+        raise ValueError("boom")
+
+    websocket = FakeWebsocket()
+    asyncio.run(dispatch(websocket, "s1", {"type": "test_failing_handler"}))
+    assert websocket.sent == [
+        {
+            "type": "invalid_message",
+            "message_type": "test_failing_handler",
+            "errors": ["message could not be handled"],
+        }
+    ]
+
+
+def test_add_to_cart_accepts_the_weighted_product_the_frontend_sends():
+    # As built by addWeightedProduct in frontend/src/pages/cart.vue
+    msg = {
+        "type": "add_to_cart",
+        "id": 101,
+        "name": "Kartoffeln",
+        "price": 1.87,
+        "quantity": 1,
+        "img": "http://localhost:8765/images/spree/products/101/potato.png",
+        "gramm": "0.340 kg",
+        "category_id": 4,
+        "category_name": "Gemüse",
+    }
+    assert HANDLERS["add_to_cart"].validate(msg) == []
+
+
+def test_add_to_cart_accepts_the_scanned_product_the_frontend_sends():
+    # As built for search_product_code replies in frontend/src/pages/cart.vue
+    msg = {
+        "type": "add_to_cart",
+        "id": 7,
+        "name": "Apfelsaft",
+        "price": "2.50",
+        "img": None,
+        "category_id": None,
+        "category_name": "",
+    }
+    assert HANDLERS["add_to_cart"].validate(msg) == []
@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+
+import image_cache
+from image_cache import ImageCache, serve_image
+
+
+def upstream_images(monkeypatch, tmp_path) -> list:
+    """Serve every image from a mock OFN, returning the list of fetched paths."""
+    fetched = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetched.append(request.url.path)
+        return httpx.Response(200, content=b"png")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(image_cache, "get_client", lambda: client)
+    monkeypatch.setattr(image_cache, "IMAGE_CACHE", ImageCache(str(tmp_path), 1024**2))
+    return fetched
+
+
+def test_catalog_images_are_served(monkeypatch, tmp_path):
+    fetched = upstream_images(monkeypatch, tmp_path)
+    image_cache.IMAGE_CACHE.allow(["/spree/products/1/apple.png"])
+    status, body, content_type = asyncio.run(
+        serve_image("/images/spree/products/1/apple.png")
+    )
+    assert (status, body, content_type) == (200, b"png", "image/png")
+    assert fetched == ["/spree/products/1/apple.png"]
+
+
+def test_paths_outside_the_catalog_are_not_proxied(monkeypatch, tmp_path):
+    fetched = upstream_images(monkeypatch, tmp_path)
+    image_cache.IMAGE_CACHE.allow(["/spree/products/1/apple.png"])
+    for path in ("/images/admin/orders", "/images/spree/products/2/pear.png"):
+        status, _, _ = asyncio.run(serve_image(path))
+        assert status == 404
+    assert fetched == []
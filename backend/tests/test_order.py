@@ -0,0 +1,277 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import order
+from order import (
+    LineItemError,
+    OFNAdminSession,
+    OrderNotDisposed,
+    SessionExpired,
+    check_session,
+    dispose_order,
+    extract_csrf_token,
+)
+
+
+def test_meta_csrf_token():
+    html = """<html><head>
+    <meta charset="utf-8">
+    <meta name="csrf-param" content="authenticity_token" />
+    <meta name="csrf-token" content="meta-token==" />
+    </head><body></body></html>"""
+    assert extract_csrf_token(html) == "meta-token=="
+
+
+def test_authenticity_token_input():
+    html = """<form action="/user/spree_user/sign_in" method="post">
+    <input type="hidden" name="utf8" value="&#x2713;">
+    <input type='hidden' name='authenticity_token' value='form-token'>
+    </form>"""
+    assert extract_csrf_token(html) == "form-token"
+
+
+def test_first_token_wins_and_attribute_order_does_not_matter():
+    html = """<META CONTENT="first" NAME="csrf-token">
+    <input value="second" name="authenticity_token">"""
+    assert extract_csrf_token(html) == "first"
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        "",
+        "<p>csrf-token</p>",
+        '<meta name="csrf-token" content="">',
+        '<input name="csrf-token" value="wrong-tag">',
+        '<meta name="authenticity_token" content="wrong-tag">',
+    ],
+)
+def test_no_token(html):
+    assert extract_csrf_token(html) is None
+
+
+class FakeOFN:
+    """Order API of a mock OFN that applies line item removals."""
+
+    def __init__(self, order: dict, apply_removals: bool = True):
+        self.order = order
+        self.apply_removals = apply_removals
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append((request.method, request.url.path))
+        assert request.headers["X-Spree-Token"] == "key"
+        if request.method == "PUT" and self.apply_removals:
+            variant_id = json.loads(request.content)["variant_id"]
+            self.order["line_items"] = [
+                item
+                for item in self.order["line_items"]
+                if item["variant"]["id"] != variant_id
+            ]
+        return httpx.Response(200, json=self.order)
+
+
+class FakeAdmin:
+    def __init__(self, ofn: FakeOFN, accept_cancel: bool):
+        self.ofn = ofn
+        self.accept_cancel = accept_cancel
+        self.fired = []
+
+    async def run_form(self, operation, order_id):
+        self.fired.append((operation.__name__, order_id))
+        if self.accept_cancel:
+            self.ofn.order["state"] = "canceled"
+
+
+def dispose(monkeypatch, ofn: FakeOFN, admin: FakeAdmin):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(ofn.handler))
+    monkeypatch.setattr(order, "get_client", lambda: client)
+    asyncio.run(dispose_order(admin, "key", "R1"))
+
+
+def cart_order() -> dict:
+    return {
+        "number": "R1",
+        "state": "cart",
+        "completed_at": None,
+        "shipments": [{"number": "H1"}],
+        "line_items": [
+            {"quantity": 2, "variant": {"id": 5}},
+            {"quantity": 1, "variant": {"id": 6}},
+        ],
+    }
+
+
+def test_incomplete_order_is_emptied(monkeypatch):
+    ofn = FakeOFN(cart_order())
+    admin = FakeAdmin(ofn, accept_cancel=False)
+    dispose(monkeypatch, ofn, admin)
+    remove = "/api/v0/orders/R1/shipments/H1/remove.json"
+    assert ofn.requests == [
+        ("GET", "/api/v0/orders/R1.json"),
+        ("PUT", remove),
+        ("PUT", remove),
+        ("GET", "/api/v0/orders/R1.json"),
+    ]
+    assert admin.fired == []
+
+
+def test_emptying_is_confirmed(monkeypatch):
+    ofn = FakeOFN(cart_order(), apply_removals=False)
+    with pytest.raises(OrderNotDisposed):
+        dispose(monkeypatch, ofn, FakeAdmin(ofn, accept_cancel=False))
+
+
+def test_completed_order_is_cancelled(monkeypatch):
+    ofn = FakeOFN({**cart_order(), "state": "complete", "completed_at": "2026-10-17"})
+    admin = FakeAdmin(ofn, accept_cancel=True)
+    dispose(monkeypatch, ofn, admin)
+    assert admin.fired == [("cancel_order", "R1")]
+
+
+def test_refused_cancel_is_not_taken_for_success(monkeypatch):
+    ofn = FakeOFN({**cart_order(), "state": "complete", "completed_at": "2026-10-17"})
+    with pytest.raises(OrderNotDisposed):
+        dispose(monkeypatch, ofn, FakeAdmin(ofn, accept_cancel=False))
+
+
+def redirected(requested: str, final: str, status: int = 200) -> httpx.Response:
+    """The final response of an admin request that OFN redirected."""
+    first = httpx.Response(302, request=httpx.Request("POST", requested))
+    return httpx.Response(status, request=httpx.Request("GET", final), history=[first])
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        redirected(
+            "https://ofn.test/admin/orders",
+            "https://ofn.test/?after_login=%2Fadmin%2Forders",
+        ),
+        redirected("https://ofn.test/admin/orders/R1/customer", "https://ofn.test/"),
+        redirected("https://ofn.test/admin/orders", "https://ofn.test/user/sign_in"),
+        httpx.Response(401, request=httpx.Request("GET", "https://ofn.test/admin")),
+    ],
+)
+def test_login_redirects_mean_the_session_expired(response):
+    with pytest.raises(SessionExpired):
+        check_session(response)
+
+
+def test_admin_responses_pass():
+    check_session(
+        redirected(
+            "https://ofn.test/admin/orders", "https://ofn.test/admin/orders/R1/edit"
+        )
+    )
+    check_session(
+        httpx.Response(200, request=httpx.Request("GET", "https://ofn.test/"))
+    )
+
+
+def test_relogin_leaves_the_old_client_usable(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="ok")
+
+    async def logged_in(http_client, email, password):
+        return {}
+
+    monkeypatch.setattr(
+        order,
+        "session_client",
+        lambda **kwargs: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setattr(order, "get_session_tokens", logged_in)
+
+    async def scenario():
+        admin = OFNAdminSession("admin@ofn.test", "secret")
+        generation = await admin.login()
+        # Another checkout is still in the middle of a request sequence
+        in_flight = admin.client
+        await admin.login(expired=generation)
+        response = await in_flight.get("https://ofn.test/admin/orders")
+        return in_flight is not admin.client, response.text
+
+    assert asyncio.run(scenario()) == (True, "ok")
+
+
+class Shipments:
+    """Mock shipments endpoint tracking how many posts run at once."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.posted = []
+        self.running = 0
+        self.max_running = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        assert "token" not in request.url.params
+        assert request.headers["X-Spree-Token"] == "secret-key"
+        variant_id = json.loads(request.content)["variant_id"]
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        self.posted.append(variant_id)
+        if variant_id in self.failing:
+            return httpx.Response(422)
+        return httpx.Response(201)
+
+
+def add_items(monkeypatch, shipments: Shipments, cart: list, concurrency: int = 3):
+    monkeypatch.setattr(order, "LINE_ITEM_CONCURRENCY", concurrency)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(shipments.handler))
+    return asyncio.run(order.add_line_items(client, "secret-key", "R1", cart))
+
+
+def items(count: int) -> list[dict]:
+    return [{"id": i, "quantity": 1} for i in range(1, count + 1)]
+
+
+def test_first_item_alone_then_the_rest_bounded(monkeypatch):
+    shipments = Shipments()
+    add_items(monkeypatch, shipments, items(10), concurrency=3)
+    assert shipments.posted[0] == 1
+    assert sorted(shipments.posted) == list(range(1, 11))
+    assert shipments.max_running == 3
+
+
+def test_failures_are_collected_without_the_token(monkeypatch):
+    shipments = Shipments(failing={3, 7})
+    with pytest.raises(LineItemError) as raised:
+        add_items(monkeypatch, shipments, items(8))
+    error = raised.value
+    assert [(item["id"], reason) for item, reason in error.failures] == [
+        (3, "HTTP 422"),
+        (7, "HTTP 422"),
+    ]
+    # Every other item was still added
+    assert len(shipments.posted) == 8
+    assert "secret-key" not in str(error)
+    assert str(error) == (
+        "Failed to add 2 line items to order R1: 3: HTTP 422, 7: HTTP 422"
+    )
+
+
+def test_nothing_else_is_posted_when_the_first_item_fails(monkeypatch):
+    shipments = Shipments(failing={1})
+    with pytest.raises(LineItemError) as raised:
+        add_items(monkeypatch, shipments, items(5))
+    assert shipments.posted == [1]
+    assert len(raised.value.failures) == 1
+
+
+def test_transport_errors_are_reported_by_class(monkeypatch):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if json.loads(request.content)["variant_id"] == 2:
+            raise httpx.ConnectError(f"failed {request.url}", request=request)
+        return httpx.Response(201)
+
+    monkeypatch.setattr(order, "LINE_ITEM_CONCURRENCY", 3)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with pytest.raises(LineItemError) as raised:
+        asyncio.run(order.add_line_items(client, "secret-key", "R1", items(3)))
+    assert [reason for _, reason in raised.value.failures] == ["ConnectError"]
@@ -0,0 +1,79 @@
+import asyncio
+
+import outbox
+import storage
+from outbox import OUTBOX_BASE_BACKOFF, Outbox
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+def new_outbox(monkeypatch, tmp_path) -> tuple[Outbox, Clock]:
+    clock = Clock()
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(outbox, "time", clock)
+    return Outbox("outbox.sqlite3"), clock
+
+
+def test_delivered_events_are_deleted(monkeypatch, tmp_path):
+    box, _ = new_outbox(monkeypatch, tmp_path)
+    received = []
+
+    async def deliver(payload):
+        received.append(payload)
+
+    box.register("invoice", deliver)
+    box.enqueue("invoice", {"order_no": "R1"})
+    box.enqueue("invoice", {"order_no": "R2"})
+    assert asyncio.run(box.drain_once()) == 2
+    assert received == [{"order_no": "R1"}, {"order_no": "R2"}]
+    assert box.stats()["depth"] == 0
+
+
+def test_failed_events_are_retried_with_exponential_backoff(monkeypatch, tmp_path):
+    box, clock = new_outbox(monkeypatch, tmp_path)
+    calls = []
+
+    async def deliver(payload):
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise Exception("IQ Tool unavailable")
+
+    box.register("invoice", deliver)
+    box.enqueue("invoice", {"order_no": "R1"})
+
+    assert asyncio.run(box.drain_once()) == 1
+    # Not due again before the first backoff has passed
+    clock.now += OUTBOX_BASE_BACKOFF - 0.1
+    assert asyncio.run(box.drain_once()) == 0
+    clock.now += 0.1
+    assert asyncio.run(box.drain_once()) == 1
+    stats = box.stats()
+    assert stats["retrying"] == 1 and stats["max_attempts"] == 2
+
+    # The second failure doubles the wait
+    clock.now += 2 * OUTBOX_BASE_BACKOFF - 0.1
+    assert asyncio.run(box.drain_once()) == 0
+    clock.now += 0.1
+    assert asyncio.run(box.drain_once()) == 1
+    assert len(calls) == 3
+    assert box.stats()["depth"] == 0
+
+
+def test_events_without_a_handler_stay_queued(monkeypatch, tmp_path):
+    box, _ = new_outbox(monkeypatch, tmp_path)
+    box.enqueue("unknown", {})
+    asyncio.run(box.drain_once())
+    assert box.stats()["by_kind"] == {"unknown": 1}
+
+
+def test_events_survive_a_restart(monkeypatch, tmp_path):
+    box, _ = new_outbox(monkeypatch, tmp_path)
+    box.enqueue("entrance_history", {"rfid_card_id": "ab12"})
+    box.conn.close()
+    assert Outbox("outbox.sqlite3").stats()["by_kind"] == {"entrance_history": 1}
@@ -0,0 +1,32 @@
+import rate_limit
+from rate_limit import ExpiringSet, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_expiring_set_forgets_keys_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    codes = ExpiringSet(60)
+    codes.add("ab12")
+    clock.now += 59
+    assert "ab12" in codes and len(codes) == 1
+    clock.now += 1
+    assert "ab12" not in codes and len(codes) == 0
+
+
+def test_rate_limiter_allows_a_key_once_per_interval(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    limiter = RateLimiter(5)
+    assert limiter.allow("ab12")
+    assert not limiter.allow("ab12")
+    assert limiter.allow("cd34")
+    clock.now += 5
+    assert limiter.allow("ab12")
@@ -0,0 +1,69 @@
+from product import Variant
+from search import ProductSearch, normalize_text
+
+
+def variant(variant_id: int, name: str) -> Variant:
+    return Variant(
+        id=variant_id,
+        sku=None,
+        name=name,
+        image="",
+        price="1.00",
+        unit_value=1.0,
+        unit="",
+        category_id=None,
+        category_name="",
+    )
+
+
+def catalog(*names: str, weighted: tuple = ()) -> dict:
+    return {
+        "product_array": {i: variant(i, name) for i, name in enumerate(names)},
+        "product_weight_array": {
+            100 + i: variant(100 + i, name) for i, name in enumerate(weighted)
+        },
+    }
+
+
+def names(results: list[dict]) -> list[str]:
+    return [result["name"] for result in results]
+
+
+def test_normalize_text_casefolds_and_strips_accents():
+    assert normalize_text("Äpfel Crème") == "apfel creme"
+
+
+def test_whole_word_ranks_above_prefix_and_name_start():
+    search = ProductSearch(catalog("Apfelsaft", "Bio Apfel", "Apfel"))
+    assert names(search.search("apfel")) == ["Apfel", "Bio Apfel", "Apfelsaft"]
+
+
+def test_prefix_and_accent_insensitive_matches():
+    search = ProductSearch(catalog("Äpfel Boskop", "Birnen"))
+    assert names(search.search("apf")) == ["Äpfel Boskop"]
+
+
+def test_typos_are_found_through_trigrams():
+    search = ProductSearch(catalog("Kartoffeln", "Karotten"))
+    assert names(search.search("kartofeln"))[0] == "Kartoffeln"
+
+
+def test_every_query_word_counts():
+    search = ProductSearch(catalog("Rote Beete", "Rote Zwiebeln", "Beete Mix"))
+    assert names(search.search("rote beete"))[0] == "Rote Beete"
+
+
+def test_weighted_products_are_marked_and_limit_is_applied():
+    search = ProductSearch(
+        catalog("Tomaten Dose", weighted=("Tomaten", "Tomaten Cherry"))
+    )
+    results = search.search("tomaten", limit=2)
+    assert [(r["name"], r["weighted"]) for r in results] == [
+        ("Tomaten", True),
+        ("Tomaten Dose", False),
+    ]
+
+
+def test_empty_query_finds_nothing():
+    search = ProductSearch(catalog("Apfel"))
+    assert search.search("  !? ") == []
@@ -0,0 +1,63 @@
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+
+from session_backend import RedisSessionBackend
+
+
+def redis_backends(count: int) -> list[RedisSessionBackend]:
+    """Backends of `count` processes sharing one fake Redis server."""
+    server = fakeredis.FakeServer()
+    return [
+        RedisSessionBackend(fakeredis.aioredis.FakeRedis(server=server))
+        for _ in range(count)
+    ]
+
+
+def product(variant_id: int) -> dict:
+    return {"id": variant_id, "name": f"Product {variant_id}", "price": "1.10"}
+
+
+def test_concurrent_update_cart_from_two_backends():
+    async def scenario():
+        first, second = redis_backends(2)
+        adds = [
+            backend.update_cart("s1", lambda cart, i=i: cart.add(product(i % 3)))
+            for i in range(20)
+            for backend in (first, second)
+        ]
+        await asyncio.gather(*adds)
+        return await first.get_cart("s1", fresh=True)
+
+    cart = asyncio.run(scenario())
+    assert cart.item_count == 40
+    assert cart.version == 40
+    assert str(cart.total) == "44.00"
+
+
+def test_end_session_is_exclusive():
+    async def scenario():
+        first, second = redis_backends(2)
+        await first.touch("s1")
+        ended = await asyncio.gather(first.end_session("s1"), second.end_session("s1"))
+        return ended, await second.last_activity()
+
+    ended, activity = asyncio.run(scenario())
+    assert sorted(ended) == [False, True]
+    assert activity == {}
+
+
+def test_end_session_keeps_cart_for_checkout_then_expires_it():
+    async def scenario():
+        (backend,) = redis_backends(1)
+        await backend.touch("s1")
+        await backend.update_cart("s1", lambda cart: cart.add(product(1)))
+        await backend.end_session("s1")
+        cart = await backend.get_cart("s1", fresh=True)
+        ttl = await backend.client.pttl(backend._key("cart", "s1"))
+        return cart, ttl
+
+    cart, ttl = asyncio.run(scenario())
+    assert cart.item_count == 1
+    assert ttl > 0
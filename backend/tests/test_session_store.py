@@ -0,0 +1,87 @@
+import asyncio
+
+import session_backend
+import storage
+from customer import CustomerDirectory
+from session_backend import MemorySessionBackend
+
+
+CUSTOMER = {
+    "exist": True,
+    "id": 7,
+    "code": "ab12",
+    "full_name": "Ada Lovelace",
+    "iban": "DE02120300000000202051",
+    "bill_address": {"street_address_1": "Hauptstraße 1"},
+}
+
+
+def test_only_a_customer_reference_is_stored(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+    lookups = []
+
+    def find(code):
+        lookups.append(code)
+        return CUSTOMER
+
+    monkeypatch.setattr(session_backend.CUSTOMER_DIRECTORY, "find", find)
+
+    async def scenario():
+        backend = MemorySessionBackend()
+        await backend.set_customer("s1", CUSTOMER)
+        await backend.touch("s1")
+        backend.store.flush()
+        (row,) = backend.store.conn.execute("SELECT customer FROM sessions")
+
+        restarted = MemorySessionBackend()
+        await restarted.start()
+        return row[0], await restarted.get_customer("s1")
+
+    stored, restored = asyncio.run(scenario())
+    assert "DE02" not in stored and "Hauptstra" not in stored
+    assert restored == CUSTOMER
+    assert lookups == ["ab12"]
+
+
+def test_ended_session_is_deleted(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+
+    async def scenario():
+        backend = MemorySessionBackend()
+        await backend.set_customer("s1", CUSTOMER)
+        await backend.touch("s1")
+        backend.store.flush()
+        await backend.end_session("s1")
+        backend.store.flush()
+        return backend.store.load()
+
+    assert asyncio.run(scenario()) == {}
+
+
+def test_restore_works_without_the_customer_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+    directory = CustomerDirectory(300, 30)
+
+    async def unreachable(ofn_api_key, max_age=0.0):
+        raise AssertionError("restoring sessions must not fetch customers")
+
+    monkeypatch.setattr(directory, "refresh", unreachable)
+    monkeypatch.setattr(session_backend, "CUSTOMER_DIRECTORY", directory)
+
+    async def scenario():
+        backend = MemorySessionBackend()
+        await backend.set_customer("s1", CUSTOMER)
+        await backend.touch("s1")
+        backend.store.flush()
+
+        restarted = MemorySessionBackend()
+        await restarted.start()
+        return (
+            await restarted.get_customer_reference("s1"),
+            await restarted.get_customer("s1"),
+        )
+
+    reference, customer = asyncio.run(scenario())
+    assert reference == {"exist": True, "id": 7, "code": "ab12"}
+    # Until the directory has loaded, the reference is all there is
+    assert customer == reference
@@ -0,0 +1,173 @@
+import bisect
+import contextvars
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 50))
+# Histogram bucket upper bounds in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    started_at: float
+    parent: str | None = None
+    duration_ms: float | None = None
+    status: int | None = None
+    error: str | None = None
+    attrs: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            **self.attrs,
+        }
+
+
+class Trace:
+    """The spans recorded while handling one checkout or draft order."""
+
+    def __init__(self, name: str, attrs: dict):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.error = None
+        self.spans = []
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "spans": [span.to_dict() for span in self.spans],
+            **self.attrs,
+        }
+
+
+class Histogram:
+    """Latency histogram with fixed millisecond buckets."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, value_ms: float, error: bool = False):
+        self.counts[bisect.bisect_left(self.bounds, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+        if error:
+            self.errors += 1
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(min(bound, self.max))
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total / self.count, 1) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max, 1),
+            "buckets": dict(zip([*map(str, self.bounds), "inf"], self.counts)),
+        }
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Collects spans into per-name latency histograms and recent traces.
+
+    Spans opened inside trace() are attached to that trace, including spans
+    from tasks started within it, and every span feeds the histogram for its
+    name whether or not a trace is active.
+    """
+
+    def __init__(self, buffer_size: int = TRACE_BUFFER_SIZE):
+        self.histograms = {}
+        self.recent = deque(maxlen=buffer_size)
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        trace = Trace(name, attrs)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        except BaseException as e:
+            # Traces are sent to clients, exception text may hold secrets
+            trace.error = type(e).__name__
+            raise
+        finally:
+            trace.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            _current_trace.reset(token)
+            self.recent.append(trace)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        parent = _current_span.get()
+        span = Span(name, time.time(), parent.name if parent else None, attrs=attrs)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            _current_span.reset(token)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.spans.append(span)
+            failed = span.error is not None or (span.status or 0) >= 400
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(span.duration_ms, failed)
+
+    def snapshot(self, limit: int | None = None) -> dict:
+        """Histograms by span name and the most recent traces, newest first."""
+        traces = list(self.recent)[::-1][:limit]
+        return {
+            "histograms": {
+                name: histogram.to_dict()
+                for name, histogram in sorted(self.histograms.items())
+            },
+            "traces": [trace.to_dict() for trace in traces],
+        }
+
+
+TRACER = Tracer()
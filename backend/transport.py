@@ -0,0 +1,118 @@
+import asyncio
+import os
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:  # HTTP/2 needs the optional h2 package
+    HTTP2_AVAILABLE = False
+
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_MAX_PER_HOST = int(os.environ.get("HTTP_MAX_PER_HOST", 6))
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.environ.get("HTTP2", "1") != "0"
+
+TIMEOUT = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that frees its per-host slot once it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release:
+                release()
+
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    """Keep-alive connection pool shared by every upstream client.
+
+    Caps the number of in-flight requests per host and ignores aclose(), so
+    short-lived clients with their own cookie jars can use the pool freely.
+    The pool itself is closed by close_transport() on shutdown.
+    """
+
+    def __init__(self):
+        self.pool = httpx.AsyncHTTPTransport(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            retries=1,
+        )
+        self.host_slots = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        slots = self.host_slots.get(host)
+        if slots is None:
+            slots = self.host_slots[host] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+        await slots.acquire()
+        try:
+            response = await self.pool.handle_async_request(request)
+        except BaseException:
+            slots.release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, slots.release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        pass
+
+
+_transport = None
+_client = None
+
+
+def get_transport() -> SharedTransport:
+    global _transport
+    if _transport is None:
+        _transport = SharedTransport()
+    return _transport
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client for stateless upstream calls."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(transport=get_transport(), timeout=TIMEOUT)
+    return _client
+
+
+def session_client(**kwargs) -> httpx.AsyncClient:
+    """Return a client with its own cookie jar on top of the shared pool."""
+    kwargs.setdefault("timeout", TIMEOUT)
+    return httpx.AsyncClient(transport=get_transport(), **kwargs)
+
+
+async def close_transport():
+    """Close all pooled connections, called once on shutdown."""
+    global _client, _transport
+    if _transport is not None:
+        await _transport.pool.aclose()
+    _client = None
+    _transport = None